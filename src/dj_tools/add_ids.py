@@ -1,9 +1,11 @@
 import hashlib
+import os
 from typing import Any
 from mutagen.mp3 import MP3
 from mutagen.id3 import ID3, UFID
 
-from .utils import list_mp3_files
+from .metadata_cache import MetadataCache
+from .utils import walk_library
 
 
 def add_ufid_to_mp3(file_path: str) -> None:
@@ -52,7 +54,12 @@ def add_ufid_to_mp3(file_path: str) -> None:
 
 
 def main():
-    files = list_mp3_files("/Users/epinzur/Desktop/Music/Traktor/")
+    files = walk_library("/Users/epinzur/Desktop/Music/Traktor/")
 
-    for file in files:
-        add_ufid_to_mp3(file_path=file)
+    with MetadataCache() as cache:
+        for file in files:
+            # Only UFIDs produce "esp-" ids, so cached files with one can be skipped unopened.
+            metadata = cache.get(file, os.stat(file))
+            if metadata is not None and f"{metadata.get('id')}".startswith("esp-"):
+                continue
+            add_ufid_to_mp3(file_path=file)
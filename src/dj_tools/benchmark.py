@@ -0,0 +1,426 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+from mutagen.id3 import (
+    APIC,
+    COMM,
+    ID3,
+    POPM,
+    TALB,
+    TBPM,
+    TCON,
+    TDOR,
+    TDRC,
+    TIT1,
+    TIT2,
+    TKEY,
+    TPE1,
+    TPE4,
+    TPUB,
+    TSRC,
+    UFID,
+)
+from PIL import Image
+
+from .key_conversion import camelot_to_open, long_to_camelot
+
+# Bump when the generated library changes, so existing libraries are regenerated.
+LIBRARY_VERSION = 1
+
+# A single silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz)
+SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+COVER_SIZES = (300, 500, 600, 1000, 1400)
+GENRES = ("Drum & Bass", "Liquid Funk", "Neurofunk", "Jungle", "Minimal", "Halftime")
+STAGES = ("walk", "extract", "extract_cached", "history", "render")
+
+
+def _cover(rng: random.Random, size: int) -> bytes:
+    """A JPEG cover of the given size, with a gradient so it is not trivially compressible."""
+    dark = rng.random() < 0.4  # dark covers are lightened when printed
+    top = tuple(rng.randint(0, 90 if dark else 255) for _ in range(3))
+    gradient = Image.linear_gradient("L").resize((size, size))
+    image = Image.composite(
+        Image.new("RGB", (size, size), top),
+        Image.new("RGB", (size, size), tuple(c // 2 for c in top)),
+        gradient,
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _tags(rng: random.Random, i: int, cover: bytes) -> ID3:
+    artist = f"Artist {rng.randint(1, 400)}"
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=f"Track {i} ({rng.choice(['Original', 'Extended', 'VIP'])} Mix)"))
+    tags.add(TPE1(encoding=3, text=artist))
+    if rng.random() < 0.2:
+        tags.add(TPE4(encoding=3, text=f"Remixer {rng.randint(1, 100)}"))
+    tags.add(TALB(encoding=3, text=f"Release {i // 4}"))
+    tags.add(TCON(encoding=3, text=rng.choice(GENRES)))
+    tags.add(TIT1(encoding=3, text=f"Label {rng.randint(1, 60)}"))
+    if rng.random() < 0.5:
+        tags.add(TPUB(encoding=3, text=f"Publisher {rng.randint(1, 20)}"))
+    year = rng.randint(1994, 2025)
+    tags.add(TDOR(encoding=3, text=f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"))
+    tags.add(TDRC(encoding=3, text=str(year)))
+    key = rng.choice(list(long_to_camelot) + list(camelot_to_open.values()))
+    tags.add(TKEY(encoding=3, text=key))
+    tags.add(TBPM(encoding=3, text=str(rng.randint(160, 176))))
+    if rng.random() < 0.5:
+        tags.add(COMM(encoding=3, lang="eng", desc="", text=f"Comment {rng.randint(1, 1000)}"))
+    tags.add(TSRC(encoding=3, text=f"GB{rng.randint(100, 999)}{year % 100:02d}{i:05d}"))
+    tags.add(POPM(email="traktor@native-instruments.de", rating=rng.choice([0, 51, 102, 153, 204, 255])))
+    tags.add(UFID(owner=f"esp-{i:08x}", data=b""))
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="", data=cover))
+    return tags
+
+
+def generate_library(library_dir: str, tracks: int, seed: int = 0, frames: int = 40) -> Path:
+    """
+    Generates a reproducible library of tiny, silent MP3 files with realistic tags.
+
+    Tracks are spread over genre/label folders, alternate between ID3v2.3 and
+    ID3v2.4, and share covers of varied sizes in groups like EP releases.
+    The library is reused when it was already generated with the same parameters.
+
+    Args:
+        library_dir (str): Directory to generate the library in.
+        tracks (int): Number of tracks.
+        seed (int): Seed of the random generator.
+        frames (int): Number of silent MP3 frames per track (about 26 ms each).
+
+    Returns:
+        Path: The library directory.
+    """
+    library = Path(library_dir)
+    marker = library / "library.json"
+    params = {"version": LIBRARY_VERSION, "tracks": tracks, "seed": seed, "frames": frames}
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return library
+    if library.exists():
+        shutil.rmtree(library)
+
+    rng = random.Random(seed)
+    audio = SILENT_FRAME * frames
+    covers = [_cover(rng, rng.choice(COVER_SIZES)) for _ in range(min(500, max(1, tracks // 4)))]
+    for i in range(tracks):
+        folder = library / rng.choice(GENRES) / f"Label {i % 60}"
+        if rng.random() < 0.05:
+            folder = folder / "not printed"
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{i:06d} - Track {i}.mp3"
+        with open(path, "wb") as f:
+            f.write(audio)
+        _tags(rng, i, covers[(i // 4) % len(covers)]).save(path, v2_version=3 if i % 2 else 4)
+    marker.write_text(json.dumps(params))
+    return library
+
+
+def generate_history(history_dir: str, items: list[dict[str, Any]], snapshots: int = 12, seed: int = 0) -> None:
+    """
+    Writes synthetic history snapshots for the given tracks.
+
+    About 70% of the tracks were printed in their current version, 10% in an
+    older version only, and the rest were never printed.
+
+    Args:
+        history_dir (str): Directory to write the Parquet snapshots to.
+        items (list[dict]): Tracks as returned by `VersionHistory.convert_metadata`.
+        snapshots (int): Number of previous runs to spread the versions over.
+        seed (int): Seed of the random generator.
+    """
+    from .version_history import VersionHistory
+
+    shutil.rmtree(history_dir, ignore_errors=True)
+    rng = random.Random(seed)
+    runs = [VersionHistory(history_dir, ids=[]) for _ in range(snapshots)]
+    revs: dict[str, int] = {}
+    for item in items:
+        roll = rng.random()
+        if roll >= 0.8:
+            continue
+        versions = [dict(item, user_comment=f"Old comment {n}") for n in range(rng.randint(0, 2))]
+        if roll < 0.7:
+            versions.append(dict(item))
+        first = rng.randrange(snapshots)
+        for n, version in enumerate(versions):
+            revs[item["id"]] = revs.get(item["id"], 0) + 1
+            version["rev"] = revs[item["id"]]
+            runs[min(snapshots - 1, first + n)].add_new_version(version)
+    for n, run in enumerate(runs):
+        run.save_new_versions(f"2025-{n // 28 + 1:02d}-{n % 28 + 1:02d}@00:00")
+
+
+def _du(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _cached_metadata(context: dict[str, Any]) -> list[dict[str, Any]]:
+    from .metadata_cache import MetadataCache
+    from .utils import walk_library
+
+    with MetadataCache(context["cache"]) as cache:
+        return [cache.extract(file) for file in walk_library(context["library"])]
+
+
+def _stage_walk(context: dict[str, Any]) -> Callable[[], dict[str, Any]]:
+    from .utils import list_mp3_files
+
+    def run() -> dict[str, Any]:
+        return {"items": len(list_mp3_files(context["library"]))}
+
+    return run
+
+
+def _stage_extract(context: dict[str, Any], cached: bool) -> Callable[[], dict[str, Any]]:
+    from .metadata_cache import MetadataCache
+    from .metadata_extraction import extract_metadata, extract_metadata_parallel
+    from .utils import list_mp3_files
+
+    files = list_mp3_files(context["library"])
+    size = sum(os.path.getsize(file) for file in files)
+    if not cached:
+        for suffix in ("", "-wal", "-shm"):
+            Path(context["cache"] + suffix).unlink(missing_ok=True)
+
+    def run() -> dict[str, Any]:
+        errors = 0
+        with MetadataCache(context["cache"]) as cache:
+            if context["workers"] > 1:
+                results = extract_metadata_parallel(files, workers=context["workers"], cache=cache)
+            else:
+                results = extract_metadata(files, cache=cache)
+            errors = sum(error is not None for _, _, error in results)
+        return {"items": len(files), "bytes": size, "errors": errors}
+
+    return run
+
+
+def _stage_history(context: dict[str, Any]) -> Callable[[], dict[str, Any]]:
+    from .version_history import VersionHistory
+
+    items = [
+        VersionHistory.convert_metadata(metadata)
+        for metadata in _cached_metadata(context)
+        if metadata.get("cover_art")
+    ]
+    history_dir = Path(context["workdir"]) / "history"
+    generate_history(str(history_dir), items, seed=context["seed"])
+    size = _du(history_dir)
+
+    def run() -> dict[str, Any]:
+        history = VersionHistory(str(history_dir), columns=[])
+        new = sum(new for new, _ in history.get_create_versions(items))
+        return {"items": len(items), "bytes": size, "new_versions": new}
+
+    return run
+
+
+def _stage_render(context: dict[str, Any]) -> Callable[[], dict[str, Any]]:
+    from .cards import create_pdf_with_layout, field_layouts
+    from .cover_art_store import CoverArtStore
+
+    cards = [m for m in _cached_metadata(context) if m.get("cover_art")][: context["cards"]]
+    for card in cards:
+        card["rev"] = 1
+    output = Path(context["workdir"]) / "cards.pdf"
+    store_dir = Path(context["workdir"]) / "cover_art"
+    shutil.rmtree(store_dir, ignore_errors=True)
+
+    def run() -> dict[str, Any]:
+        count = create_pdf_with_layout(
+            str(output), cards, field_layouts, cover_store=CoverArtStore(str(store_dir))
+        )
+        return {"items": count, "bytes": output.stat().st_size}
+
+    return run
+
+
+def _reset_peak_rss() -> None:
+    """Resets the peak RSS of this process to its current RSS, where the OS allows it (Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _run_stage(stage: str, context: dict[str, Any]) -> dict[str, Any]:
+    """
+    Sets up and times a stage, in a fresh process.
+
+    The peak RSS is reset after the setup, so it covers the timed run only.
+    Where it cannot be reset (macOS) it includes the setup. Extraction
+    workers are separate processes: the peak RSS of the largest of them is
+    reported on its own, as they run side by side.
+    """
+    setup = {
+        "walk": lambda: _stage_walk(context),
+        "extract": lambda: _stage_extract(context, cached=False),
+        "extract_cached": lambda: _stage_extract(context, cached=True),
+        "history": lambda: _stage_history(context),
+        "render": lambda: _stage_render(context),
+    }[stage]
+    # Progress messages of the pipeline would interleave with the report
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        run = setup()
+        _reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    result["seconds"] = wall
+    result["cpu_seconds"] = cpu
+    result["items_per_second"] = result["items"] / wall if wall else None
+    if "bytes" in result:
+        result["mb_per_second"] = result["bytes"] / wall / 1e6 if wall else None
+    result["peak_rss_mb"] = _peak_rss_mb()
+    # Only the extraction workers are children of the stage process, reaped when their pool closes
+    result["worker_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def run_benchmark(
+    workdir: str,
+    tracks: int,
+    seed: int = 0,
+    cards: int = 100,
+    workers: int = 1,
+    stages: tuple[str, ...] = STAGES,
+) -> dict[str, Any]:
+    """
+    Runs every stage against a synthetic library of the given size.
+
+    Args:
+        workdir (str): Directory for the library, cache, history and output.
+        tracks (int): Number of tracks in the library.
+        seed (int): Seed of the synthetic data.
+        cards (int): Number of cards rendered by the render stage.
+        workers (int): Number of extraction processes.
+        stages (tuple[str, ...]): Stages to run, in order.
+
+    Returns:
+        dict: The results of each stage.
+    """
+    root = Path(workdir)
+    library = generate_library(str(root / f"library-{tracks}-{seed}"), tracks, seed=seed)
+    context = {
+        "workdir": str(root / f"run-{tracks}-{seed}"),
+        "library": str(library),
+        "cache": str(root / f"run-{tracks}-{seed}" / "metadata_cache.sqlite"),
+        "seed": seed,
+        "cards": cards,
+        "workers": workers,
+    }
+    Path(context["workdir"]).mkdir(parents=True, exist_ok=True)
+    if "extract" not in stages and not Path(context["cache"]).exists():
+        # Later stages read their input from the metadata cache
+        stages = ("extract", *stages)
+
+    results = {}
+    spawn = multiprocessing.get_context("spawn")
+    for stage in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            results[stage] = executor.submit(_run_stage, stage, context).result()
+        print(_format_row(stage, results[stage]))
+    return {"tracks": tracks, "seed": seed, "cards": cards, "workers": workers, "stages": results}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_row(stage: str, result: dict[str, Any], baseline: dict[str, Any] | None = None) -> str:
+    row = (
+        f"{stage:<16}{result['items']:>9}{result['seconds']:>10.2f}"
+        f"{result['items_per_second'] or 0:>12.1f}{result.get('mb_per_second') or 0:>9.1f}"
+        f"{result['peak_rss_mb']:>10.1f}{result.get('worker_peak_rss_mb') or 0:>11.1f}"
+    )
+    if baseline is not None and baseline.get("seconds"):
+        row += f"{result['seconds'] / baseline['seconds']:>9.2f}x"
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the card pipeline on a synthetic library.")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000], help="Library sizes to run.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cards", type=int, default=100, help="Cards rendered by the render stage.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of extraction processes.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--workdir", default="data/benchmark")
+    parser.add_argument("--output", help="JSON report path (default: <workdir>/results/<timestamp>.json).")
+    parser.add_argument("--compare", help="Previous JSON report to compare the timings against.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {run["tracks"]: run["stages"] for run in json.load(f)["runs"]}
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [],
+    }
+    header = f"{'stage':<16}{'items':>9}{'seconds':>10}{'items/s':>12}{'MB/s':>9}{'peak MB':>10}{'worker MB':>11}"
+    for tracks in args.tracks:
+        print(f"\n{tracks} tracks")
+        print(header)
+        run = run_benchmark(
+            args.workdir,
+            tracks,
+            seed=args.seed,
+            cards=args.cards,
+            workers=args.workers,
+            stages=tuple(args.stages),
+        )
+        report["runs"].append(run)
+        if baseline is not None and tracks in baseline:
+            print(f"compared to {args.compare}")
+            print(header + f"{'ratio':>10}")
+            for stage, result in run["stages"].items():
+                if stage in baseline[tracks]:
+                    print(_format_row(stage, result, baseline[tracks][stage]))
+
+    output = Path(args.output or Path(args.workdir) / "results" / f"{datetime.now():%Y-%m-%d@%H:%M:%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
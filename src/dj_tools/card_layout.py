@@ -3,45 +3,138 @@ from reportlab.lib.units import mm
 from reportlab.pdfgen.canvas import Canvas
 from reportlab.lib.utils import ImageReader, simpleSplit
 from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
-from .field_layout import FieldLayout
+from . import profiling
+from .cover_art import CoverArt
+from .cover_art_store import CoverArtStore
+from .field_layout import CompiledField
 
+import hashlib
+import math
+from functools import lru_cache
 from io import BytesIO
 from typing import Any
 
 from .image_manipulation import (
-    is_dark,
-    lighten_image,
-    generate_qr_code,
+    SEARCH_QR_VERSION,
+    prepare_cover_art,
+    qr_modules,
 )
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
 UNPRINTABLE_BORDER = 8*mm
 CARD_WIDTH = (PAGE_WIDTH / 2) - (UNPRINTABLE_BORDER * 2)
 CARD_HEIGHT = (PAGE_HEIGHT / 2) - (UNPRINTABLE_BORDER * 2)
+PRINT_DPI = 300
+
+
+def print_pixels(size: float) -> int:
+    """Number of pixels needed to print `size` points at PRINT_DPI."""
+    return math.ceil(size / 72 * PRINT_DPI)
+
+
+@lru_cache(maxsize=16384)
+def wrap_text(
+    text: str, font: str, font_size: float, width: float
+) -> tuple[tuple[str, float], ...]:
+    """
+    Wrap text to a width, memoised as the same strings recur on many cards.
+
+    Args:
+        text (str): The text to wrap.
+        font (str): Font name.
+        font_size (float): Font size.
+        width (float): Width to wrap the text at.
+
+    Returns:
+        tuple[tuple[str, float], ...]: Each wrapped line with its width.
+    """
+    return tuple(
+        (line, stringWidth(line, font, font_size))
+        for line in simpleSplit(text, font, font_size, width)
+    )
+
+class ImageRegistry:
+    def __init__(self, pdf: Canvas):
+        """
+        Images embedded in a PDF, keyed by a hash of their content.
+
+        Each image is embedded once as a form and every later draw only
+        references it, so the image is never read or digested again.
+
+        Args:
+            pdf (Canvas): The ReportLab canvas the images are embedded in.
+        """
+        self.pdf = pdf
+        self.images: dict[str, tuple[str, int, int]] = {}
+
+    def draw(self, key: str, image_data: Any, x: float, y: float, size: float) -> None:
+        """
+        Draw an image scaled to fit a square box, anchored to the top of the box.
+
+        Args:
+            key (str): Hash identifying the image content.
+            image_data (Any): File path or file-like object, only read the first time `key` is drawn.
+            x (float): X-coordinate of the box on the page.
+            y (float): Y-coordinate of the box on the page.
+            size (float): Size of the box.
+        """
+        image = self.images.get(key)
+        if image is None:
+            reader = ImageReader(image_data)
+            width, height = reader.getSize()
+            name = f"img-{key}"
+            self.pdf.beginForm(name, lowerx=0, lowery=0, upperx=width, uppery=height)
+            # Files are passed as paths so JPEGs are embedded without being re-encoded
+            source = image_data if isinstance(image_data, str) else reader
+            self.pdf.drawImage(source, x=0, y=0, width=width, height=height)
+            self.pdf.endForm()
+            image = self.images[key] = (name, width, height)
+
+        name, width, height = image
+        scale = min(size / width, size / height)
+        self.pdf.saveState()
+        self.pdf.translate(x + (size - width * scale) / 2, y + size - height * scale)
+        self.pdf.scale(scale, scale)
+        self.pdf.doForm(name)
+        self.pdf.restoreState()
+
 
 class CardLayout:
     def __init__(
-        self, x_offset: float, y_offset: float, pdf: Canvas, card: dict[str, Any]
+        self,
+        x_offset: float,
+        y_offset: float,
+        pdf: Canvas,
+        card: dict[str, Any],
+        cover_store: CoverArtStore | None = None,
+        images: ImageRegistry | None = None,
     ):
         self.inner_widths: dict[str, float] = {}
         self.x_offset = x_offset
         self.y_offset = y_offset
         self.card = card
         self.pdf = pdf
+        self.cover_store = cover_store
+        self.images = images
+        # Font last set by this card, the page's font is unknown before its first field
+        self.font: tuple[str, float] | None = None
+
+    def _set_font(self, font: str, font_size: float) -> None:
+        """Set the font, skipping the PDF operator if this card already set it."""
+        if self.font != (font, font_size):
+            self.pdf.setFont(font, font_size)
+            self.font = (font, font_size)
 
     def draw_field(
         self,
-        field: FieldLayout,
+        field: CompiledField,
     ) -> int:
         """Draw a single field on the card with text wrapping, returning the number of lines used.
 
         Args:
-            pdf (Canvas): The ReportLab canvas.
-            field (FieldLayout): The field layout details.
-            data (dict): The data containing field values.
-            x_offset (float): X position offset.
-            y_offset (float): Y position offset.
+            field (CompiledField): The compiled field layout, see `compile_layouts`.
 
         Returns:
             int: The number of lines used
@@ -49,27 +142,31 @@ class CardLayout:
         value = self.card.get(field.field_name, "")
         if not value and field.field_name != "datestamp":
             return 0  # No text drawn
-        
+
         if value in ["Purchased at Traxsource.com", "Purchased at Beatport.com", "Purchased at Beatport"]:
             return 0
 
-        value = f"{field.prefix}{value}"
-        self.pdf.setFont(field.font, field.font_size)
+        with profiling.stage("text"):
+            return self._draw_text(field, f"{field.prefix}{value}")
+
+    def _draw_text(self, field: CompiledField, value: str) -> int:
+        self._set_font(field.font, field.font_size)
 
         text_x = self.x_offset + field.x
         text_y = self.y_offset + field.y
 
-        # Wrap text using simpleSplit
-        wrapped_lines = simpleSplit(value, field.font, field.font_size, field.width)
-
+        wrapped_lines = wrap_text(value, field.font, field.font_size, field.width)
         if len(wrapped_lines) > field.max_lines:
             wrapped_lines = wrapped_lines[: field.max_lines]  # Keep only allowed lines
 
+        if field.between is not None:
+            left, right = field.between
+            center = (self.inner_widths[left] + self.inner_widths[right]) / 2
+
         max_width = 0
 
         # Adjust for justification and draw lines
-        for line in wrapped_lines:
-            text_width = self.pdf.stringWidth(line, field.font, field.font_size)
+        for line, text_width in wrapped_lines:
             max_width = max(max_width, text_width)
             if field.justification == "right":
                 draw_x = text_x - text_width
@@ -77,22 +174,17 @@ class CardLayout:
                 draw_x = text_x - text_width / 2
             elif field.justification == "left":
                 draw_x = text_x
-            elif field.justification.startswith("between:"):
-                between = field.justification.split(":")[1]
-                between = between.split("&")
-                left = self.inner_widths[between[0]]
-                right = self.inner_widths[between[1]]
-                draw_x = (left + right - text_width) / 2
+            else:
+                draw_x = center - text_width / 2
 
             self.pdf.drawString(draw_x, text_y, line)
             text_y -= field.font_size * 1.2  # Move to the next line with spacing
 
+        if wrapped_lines:
             if field.justification == "right":
                 self.inner_widths[field.field_name] = text_x - max_width
             elif field.justification == "left":
                 self.inner_widths[field.field_name] = text_x + max_width
-            else:
-                draw_x = text_x
 
         return len(wrapped_lines)
 
@@ -108,11 +200,17 @@ class CardLayout:
         self.pdf.setStrokeColor(colors.black)
         self.pdf.setLineWidth(1)
 
-    def _draw_image(self, image_data: bytes, x: float, y: float, size: float):
+    def _draw_image(
+        self, image_data: Any, x: float, y: float, size: float, key: str | None = None
+    ):
         try:
-            image = ImageReader(image_data)
             x = self.x_offset + x
             y = self.y_offset + y
+            if self.images is not None and key is not None:
+                self.images.draw(key, image_data, x=x, y=y, size=size)
+                return
+            # Files are passed as paths so JPEGs are embedded without being re-encoded
+            image = image_data if isinstance(image_data, str) else ImageReader(image_data)
             self.pdf.drawImage(
                 image,
                 x=x,
@@ -126,27 +224,71 @@ class CardLayout:
             print(f"Error drawing image from binary data, {e}")
 
     def draw_cover_art(self, x: float, y: float, size: float) -> None:
-        """Draw cover art on the card using binary image data."""
+        """Draw cover art on the card, reading the image data only now."""
 
         image_data = self.card.get("cover_art")
         if not image_data:
             return
+        length = image_data.length if isinstance(image_data, CoverArt) else len(image_data)
+        with profiling.stage("cover_art", size=length):
+            try:
+                self._draw_cover_art(image_data, x, y, size)
+            except Exception as e:
+                # An undecodable cover only loses its image, not the whole run
+                print(f"Error drawing cover art of {self.card.get('file')}, {e}")
 
-        cycles = 0
-        while is_dark(image_data):
-            cycles += 1
-            # print(f"{card.get("title")}: is dark, lightening")
-            image_data = lighten_image(image_data, factor=1.5)
-            if cycles > 2:
-                break
+    def _draw_cover_art(self, image_data: CoverArt | bytes, x: float, y: float, size: float) -> None:
+        if isinstance(image_data, CoverArt):
+            if self.cover_store is not None:
+                # Processed once per unique cover and print size, shared by every card using it
+                path = self.cover_store.prepared(image_data, size=print_pixels(size))
+                self._draw_image(image_data=str(path), x=x, y=y, size=size, key=path.stem)
+                return
+            key = f"{image_data.md5}-{print_pixels(size)}px"
+            if self.images is not None and key in self.images.images:
+                self._draw_image(image_data=None, x=x, y=y, size=size, key=key)
+                return
+            image_data = image_data.read()
+        else:
+            key = f"{hashlib.md5(image_data).hexdigest()}-{print_pixels(size)}px"
 
-        self._draw_image(image_data=BytesIO(image_data), x=x, y=y, size=size)
+        with profiling.stage("lighten", size=len(image_data)):
+            image_data = prepare_cover_art(image_data, factor=1.5, size=print_pixels(size))
+        self._draw_image(image_data=BytesIO(image_data), x=x, y=y, size=size, key=key)
 
     # Draw the QR code on the card
     def draw_qr_code(self, x: float, y: float, size: float) -> None:
-        search = self.card.get("search")
-        if search is None:
+        """
+        Draw the QR code as vector modules, defined once per PDF as a form and reused.
+
+        Cards with a 'qr_id' encode that compact track id, resolved by the scanner's
+        track index, in the smallest QR version that fits it. Its larger modules decode
+        faster and from farther away. Other cards encode their search text.
+        """
+        qr_id = self.card.get("qr_id")
+        if qr_id is not None:
+            text, version = qr_id, 1
+        else:
+            text, version = self.card.get("search"), SEARCH_QR_VERSION
+        if text is None:
             return
+        with profiling.stage("qr"):
+            self._draw_qr_code(text, x, y, size, version)
+
+    def _draw_qr_code(self, text: str, x: float, y: float, size: float, version: int) -> None:
+        modules, runs = qr_modules(text, version)
+        name = f"qr-{hashlib.md5(text.encode('utf-8')).hexdigest()}-{version}"
+        if not self.pdf.hasForm(name):
+            self.pdf.beginForm(name, lowerx=0, lowery=0, upperx=modules, uppery=modules)
+            self.pdf.setFillColor(colors.black)
+            path = self.pdf.beginPath()
+            for run_x, run_y, length in runs:
+                path.rect(run_x, run_y, length, 1)
+            self.pdf.drawPath(path, stroke=0, fill=1)
+            self.pdf.endForm()
 
-        qr_image = generate_qr_code(search)
-        self._draw_image(image_data=qr_image, x=x, y=y, size=size)
+        self.pdf.saveState()
+        self.pdf.translate(self.x_offset + x, self.y_offset + y)
+        self.pdf.scale(size / modules, size / modules)
+        self.pdf.doForm(name)
+        self.pdf.restoreState()
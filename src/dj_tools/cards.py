@@ -1,22 +1,40 @@
+import argparse
+import cProfile
+import math
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from itertools import batched
+from typing import Iterable, Iterator
 from dj_tools.version_history import VersionHistory
-from .utils import list_mp3_files
+from . import profiling
+from .library_scan import LibraryScan, add_scan_arguments
+from .track_index import DEFAULT_INDEX_PATH, TrackIndex
 
-from .field_layout import FieldLayout
+from .field_layout import FieldLayout, LayoutPlan, compile_layouts
 
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
 
 from .card_layout import (
     UNPRINTABLE_BORDER,
-    PAGE_HEIGHT, PAGE_WIDTH, CARD_HEIGHT, CARD_WIDTH, CardLayout
+    PAGE_HEIGHT, PAGE_WIDTH, CARD_HEIGHT, CARD_WIDTH, CardLayout, ImageRegistry, print_pixels
 )
 
-from .metadata_extraction import extract_mp3_metadata
+from .cover_art_store import DEFAULT_STORE_DIR, CoverArtStore, prefetch_prepared
 
 DEBUG = False
 
+# Tracks whose versions are looked up together while streaming. A stream whose
+# length is not known upfront is sharded so that a chunk's cards keep every worker busy.
+VERSION_CHUNK_SIZE = 64
+
+# Embed images as binary streams, ASCII85 makes them 25% larger and is slow to encode
+rl_config.useA85 = 0
+
 left_edge = 0
 right_edge = CARD_WIDTH
 top_edge = CARD_HEIGHT
@@ -101,38 +119,73 @@ def _card_offset(j: int, front: bool) -> tuple[float, float]:
     return x_offset, y_offset
 
 
-def create_pdf_with_layout(output_path: str, cards: list[dict], layouts: list[FieldLayout]) -> None:
+def draw_card_side(layout: CardLayout, plan: LayoutPlan, front: bool) -> None:
+    """Draw the cover art, QR code and fields of one side of a card."""
+    if DEBUG:
+        layout.draw_card_border()
+    if front:
+        layout.draw_cover_art(x=front_art_x, y=front_art_y, size=front_art_size)
+        layout.draw_qr_code(x=front_qr_x, y=front_qr_y, size = front_qr_size)
+        fields = plan.front
+    else:
+        layout.draw_cover_art(x=back_art_x, y=back_art_y, size=back_art_size)
+        layout.draw_qr_code(x=back_qr_x, y=back_qr_y, size = back_qr_size)
+        fields = plan.back
+
+    for field in fields:
+        layout.draw_field(field)
+
+
+def create_pdf_with_layout(
+    output_path: str,
+    cards: Iterable[dict],
+    layouts: list[FieldLayout],
+    cover_store: CoverArtStore | None = None,
+    image_workers: int = 0,
+) -> int:
     """
     Generates a PDF with A6 cards laid out on A4 paper, using layout instructions.
 
+    Cards are consumed one sheet of 4 at a time and each page is flushed
+    once drawn, so `cards` can be a generator that is still extracting
+    metadata while the first sheets are written.
+
     Args:
         output_path (str): Path to save the generated PDF.
-        cards (list[dict]): List of metadata dictionaries for each card.
+        cards (Iterable[dict]): Metadata dictionaries for each card.
         layouts (list[FieldLayout]): Layout instructions for fields.
-    """
-    if len(cards) == 0:
-        print("No new cards to output")
-        return
+        cover_store (CoverArtStore | None): Store used to process each unique cover once.
+        image_workers (int): Prepare cover art for upcoming cards in this many processes
+            while the canvas is drawn (0 prepares it inline).
 
+    Returns:
+        int: The number of cards drawn, the PDF is not written if there are none.
+    """
+    plan = compile_layouts(layouts)
     pdf = canvas.Canvas(output_path, pagesize=A4)
+    images = ImageRegistry(pdf)
+
+    if cover_store is not None and image_workers > 0:
+        sizes = (print_pixels(front_art_size), print_pixels(back_art_size))
+        cards = prefetch_prepared(cards, cover_store, sizes, workers=image_workers)
 
-    for i in range(0, len(cards), 4):
-        current_cards = cards[i:i + 4]
+    count = 0
+    for current_cards in batched(cards, 4):
+        count += len(current_cards)
 
         # Draw front of the cards
         for j, card in enumerate(current_cards):
             x_offset, y_offset = _card_offset(j, True)
 
-            layout = CardLayout(x_offset=x_offset, y_offset=y_offset, pdf=pdf, card=card)
-            if DEBUG:
-                layout.draw_card_border()
-            layout.draw_cover_art(x=front_art_x, y=front_art_y, size=front_art_size)
-            layout.draw_qr_code(x=front_qr_x, y=front_qr_y, size = front_qr_size)
-
-            # Draw fields on the front
-            for field in layouts:
-                if field.side == "front":
-                    lines = layout.draw_field(field)
+            layout = CardLayout(
+                x_offset=x_offset,
+                y_offset=y_offset,
+                pdf=pdf,
+                card=card,
+                cover_store=cover_store,
+                images=images,
+            )
+            draw_card_side(layout, plan, front=True)
 
         pdf.showPage()  # Add new page for the back side
 
@@ -140,50 +193,253 @@ def create_pdf_with_layout(output_path: str, cards: list[dict], layouts: list[Fi
         for j, card in enumerate(current_cards):
             x_offset, y_offset = _card_offset(j, False)
 
-            layout = CardLayout(x_offset=x_offset, y_offset=y_offset, pdf=pdf, card=card)
-            if DEBUG:
-                layout.draw_card_border()
-            layout.draw_cover_art(x=back_art_x, y=back_art_y, size=back_art_size)
-            layout.draw_qr_code(x=back_qr_x, y=back_qr_y, size = back_qr_size)
-
-            # Draw fields on the back
-            for field in layouts:
-                if field.side == "back":
-                    lines = layout.draw_field(field)
+            layout = CardLayout(
+                x_offset=x_offset,
+                y_offset=y_offset,
+                pdf=pdf,
+                card=card,
+                cover_store=cover_store,
+                images=images,
+            )
+            draw_card_side(layout, plan, front=False)
 
         pdf.showPage()  # Finish the page
 
-    pdf.save()
+    if count == 0:
+        print("No new cards to output")
+        return 0
+    with profiling.stage("pdf_save"):
+        pdf.save()
+    profiling.add_bytes("pdf_save", os.path.getsize(output_path))
+    return count
+
+
+def _render_shard(
+    output_path: str,
+    cards: list[dict],
+    layouts: list[FieldLayout],
+    cover_store_dir: str | None,
+) -> str:
+    cover_store = None if cover_store_dir is None else CoverArtStore(cover_store_dir)
+    create_pdf_with_layout(output_path, cards, layouts, cover_store=cover_store)
+    return output_path
+
+
+def _merge_pdfs(output_path: str, paths: list[str]) -> bool:
+    """Concatenate PDFs into one file with pypdf, returning False if it is not installed."""
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        return False
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    writer.close()
+    return True
+
+
+def create_pdf_sharded(
+    output_path: str,
+    cards: Iterable[dict],
+    layouts: list[FieldLayout],
+    cover_store: CoverArtStore | None = None,
+    workers: int | None = None,
+    shard_size: int | None = None,
+    merge: bool = True,
+) -> list[str]:
+    """
+    Generates the cards PDF in shards rendered by parallel processes.
 
+    Shards always hold whole sheets of 4 cards, so every shard starts on a
+    front page and the front/back pairing of each sheet is the same as in
+    a single `create_pdf_with_layout` run. Shards are submitted as soon as
+    they fill, and at most two per worker are buffered.
 
-def main():
-    files = list_mp3_files("/Users/epinzur/Desktop/Music/Traktor/dnb")
-    history = VersionHistory("data/track_history")
-    data = []
-    for file in files:
-
-        metadata = extract_mp3_metadata(file)
-        # if metadata.get("stars", 0) < 4:
-        #     continue
-
-        if not metadata.get("cover_art"):
-            continue
-
-        item = history.convert_metadata(metadata)
-        (new, v) = history.get_create_version(item)
-        if new:
-            metadata["rev"] = v
-            item["rev"] = v
-            history.add_new_version(item)
-            data.append(metadata)
+    Args:
+        output_path (str): Path to save the generated PDF.
+        cards (Iterable[dict]): Metadata dictionaries for each card.
+        layouts (list[FieldLayout]): Layout instructions for fields.
+        cover_store (CoverArtStore | None): Store used to process each unique cover once.
+        workers (int | None): Number of processes rendering shards (default: CPU count).
+        shard_size (int | None): Cards per shard, rounded up to whole sheets (default: the
+            cards split evenly between the workers, or a VERSION_CHUNK_SIZE batch split between
+            them for a generator).
+        merge (bool): Concatenate the shards into `output_path` (requires pypdf),
+            instead of keeping numbered files next to it.
+
+    Returns:
+        list[str]: The paths of the written PDFs, in print order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if shard_size is None:
+        if isinstance(cards, list):
+            shard_size = math.ceil(len(cards) / 4 / workers) * 4
+        else:
+            shard_size = math.ceil(VERSION_CHUNK_SIZE / 4 / workers) * 4
+    shard_size = max(4, math.ceil(shard_size / 4) * 4)
+
+    stem, ext = os.path.splitext(output_path)
+    cover_store_dir = None if cover_store is None else str(cover_store.store_dir)
+    paths: list[str] = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future] = deque()
+        for shard in batched(cards, shard_size):
+            path = f"{stem}-{len(paths) + 1:03d}{ext}"
+            paths.append(path)
+            pending.append(
+                executor.submit(_render_shard, path, list(shard), layouts, cover_store_dir)
+            )
+            if len(pending) >= workers * 2:
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+
+    if len(paths) == 0:
+        print("No new cards to output")
+        return []
 
-    timestamp = datetime.now().strftime("%Y-%m-%d@%H:%M")
+    if not merge or len(paths) == 1:
+        if len(paths) == 1:
+            os.replace(paths[0], output_path)
+            return [output_path]
+        return paths
+    if not _merge_pdfs(output_path, paths):
+        print(f"pypdf is not installed, cards were written to {len(paths)} numbered files")
+        return paths
+    for path in paths:
+        os.remove(path)
+    return [output_path]
 
-    create_pdf_with_layout(f"new_cards_{timestamp}.pdf", data, field_layouts)
 
-    if not DEBUG:
-        history.save_new_versions(timestamp)
+def main():
+    parser = argparse.ArgumentParser(description="Print cards for new track versions.")
+    add_scan_arguments(parser)
+    parser.add_argument("--cover-art", default=DEFAULT_STORE_DIR)
+    parser.add_argument(
+        "--reprint-cache",
+        default="data/reprint_cache",
+        help="Directory where printed cards are recorded for the reprint command.",
+    )
+    parser.add_argument(
+        "--image-workers",
+        type=int,
+        default=0,
+        help="Number of processes preparing cover art ahead of the PDF writer.",
+    )
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=1,
+        help="Number of processes rendering the PDF in shards of whole sheets.",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="With --pdf-workers, keep the shards as numbered PDFs instead of merging them.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each stage and save it as a JSON report.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        help="Path of the JSON profile report (default: data/profiles/<timestamp>.json).",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="With --profile, also record the peak memory of each stage (slow).",
+    )
+    parser.add_argument("--cprofile", help="Save cProfile statistics of the run to this path.")
+    parser.add_argument(
+        "--qr-id",
+        action="store_true",
+        help="Encode the track id in QR codes instead of the search text, in a smaller QR "
+        "code resolved by the scanner's track index.",
+    )
+    parser.add_argument(
+        "--track-index",
+        default=DEFAULT_INDEX_PATH,
+        help="Path of the track index rebuilt after saving new versions.",
+    )
+    args = parser.parse_args()
+
+    # Imported here as the reprint module builds on this one
+    from .reprint import ReprintCache
+
+    profiler = profiling.enable(trace_memory=args.trace_memory) if args.profile else None
+    if args.cprofile:
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+
+    scan = LibraryScan.from_args(args)
+
+    # Only the fingerprints are needed. The changed ids are not known until
+    # the stream is consumed, so the history of every track is loaded.
+    with profiling.stage("history"):
+        history = VersionHistory(args.history, columns=[])
+    reprints = ReprintCache(args.reprint_cache)
+    cover_store = CoverArtStore(args.cover_art)
+
+    # Recorded for reprints with the history, once the PDF is written
+    printed: list[dict] = []
+
+    def new_cards() -> Iterator[dict]:
+        for chunk in batched(scan, VERSION_CHUNK_SIZE):
+            with profiling.stage("history"):
+                versions = history.get_create_versions([item for _, item in chunk])
+            for (metadata, item), (new, v) in zip(chunk, versions):
+                if new:
+                    metadata["rev"] = v
+                    item["rev"] = v
+                    if args.qr_id:
+                        # Upper case fits the QR alphanumeric mode, ids are resolved case-insensitively
+                        metadata["qr_id"] = metadata["id"].upper()
+                    history.add_new_version(item)
+                    printed.append(metadata)
+                    yield metadata
 
-    
+    timestamp = datetime.now().strftime("%Y-%m-%d@%H:%M")
 
+    with profiling.stage("pdf"):
+        if args.pdf_workers > 1:
+            create_pdf_sharded(
+                f"new_cards_{timestamp}.pdf",
+                new_cards(),
+                field_layouts,
+                cover_store=cover_store,
+                workers=args.pdf_workers,
+                merge=not args.split,
+            )
+        else:
+            create_pdf_with_layout(
+                f"new_cards_{timestamp}.pdf",
+                new_cards(),
+                field_layouts,
+                cover_store=cover_store,
+                image_workers=args.image_workers,
+            )
+
+    scan.close()
 
+    if not DEBUG:
+        with profiling.stage("save"):
+            saved = history.save_new_versions(timestamp)
+            scan.manifest.save()
+            for card in printed:
+                reprints.save_card(card, datestamp, cover_store)
+        if saved:
+            with profiling.stage("track_index"):
+                TrackIndex.build(args.history, args.manifest).save(args.track_index)
+
+    if args.cprofile:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.cprofile)
+        print(f"cProfile statistics saved to {args.cprofile}")
+    if profiler is not None:
+        print(profiler.summary())
+        profiler.save(args.profile_output or f"data/profiles/{timestamp}.json")
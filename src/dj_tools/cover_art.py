@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import mmap
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+
+def _find(buffer: bytes | mmap.mmap, data: bytes, search_limit: int | None) -> int:
+    """Returns the offset of `data` in the first `search_limit` bytes of a buffer, or -1."""
+    end = len(buffer) if search_limit is None else min(search_limit, len(buffer))
+    offset = buffer.find(data[:64], 0, end)
+    while offset != -1:
+        if buffer[offset:offset + len(data)] == data:
+            return offset
+        offset = buffer.find(data[:64], offset + 1, end)
+    return -1
+
+
+class CoverArt:
+    def __init__(
+        self,
+        file_path: str,
+        offset: int,
+        length: int,
+        md5: str,
+        data: bytes | None = None,
+    ):
+        """
+        Reference to cover art embedded in an audio file.
+
+        Only the location of the image inside the file is kept, so the image
+        bytes are read when they are needed instead of living in memory for
+        the whole run. `data` is only set when the image could not be located
+        verbatim in the file (e.g. unsynchronised or compressed ID3 frames).
+
+        Args:
+            file_path (str): The path to the audio file.
+            offset (int): Byte offset of the image data in the file.
+            length (int): Length of the image data in bytes.
+            md5 (str): Hexadecimal MD5 hash of the image data.
+            data (bytes | None): The image data, if it cannot be read lazily.
+        """
+        self.file_path = file_path
+        self.offset = offset
+        self.length = length
+        self.md5 = md5
+        self.data = data
+
+    def __bool__(self) -> bool:
+        # Like the image bytes it stands for, so tracks with an empty cover art frame are skipped
+        return self.length > 0
+
+    @classmethod
+    def locate(
+        cls,
+        file_path: str,
+        data: bytes,
+        search_limit: int | None = None,
+        head: bytes | None = None,
+    ) -> "CoverArt":
+        """
+        Creates a reference to image data that was read from a file.
+
+        Args:
+            file_path (str): The path to the audio file the data came from.
+            data (bytes): The image data.
+            search_limit (int | None): Only search this many bytes from the start of the file.
+            head (bytes | None): The first bytes of the file, if already read. They are searched
+                instead of the file, so they must extend to `search_limit`.
+
+        Returns:
+            CoverArt: A lazy reference, or one holding `data` if it could not be located.
+        """
+        md5 = hashlib.md5(data).hexdigest()
+        if head is not None:
+            offset = _find(head, data, search_limit)
+            if offset != -1:
+                return cls(file_path, offset, len(data), md5)
+            return cls(file_path, 0, len(data), md5, data=data)
+        try:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = _find(mm, data, search_limit)
+                if offset != -1:
+                    return cls(file_path, offset, len(data), md5)
+        except (OSError, ValueError):
+            pass
+        return cls(file_path, 0, len(data), md5, data=data)
+
+    @contextmanager
+    def view(self) -> Iterator[memoryview]:
+        """Yields a zero-copy, read-only view of the image data backed by an mmap of the file."""
+        if self.data is not None:
+            with memoryview(self.data) as view:
+                yield view
+            return
+        with open(self.file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as whole, whole[self.offset:self.offset + self.length] as view:
+                yield view
+
+    def read(self) -> bytes:
+        """
+        Materialises the image data, checking it is still the cover art that was extracted.
+
+        Raises:
+            ValueError: If the file no longer contains the cover art.
+        """
+        if self.data is not None:
+            return self.data
+        with self.view() as view:
+            data = view.tobytes()
+        if hashlib.md5(data).hexdigest() != self.md5:
+            # The tags were rewritten since extraction, e.g. by DJ software updating GEOB frames
+            data = self._relocate()
+        return data
+
+    def _relocate(self) -> bytes:
+        """Finds the cover art in the current tags of the file, and points the reference to it."""
+        # Imported here as reading the tags again is only needed once a file changed
+        import mutagen
+
+        from .tag_mapping import scheme_for
+
+        audio = mutagen.File(self.file_path)
+        tags = audio.tags if audio is not None else None
+        pictures = [picture.data for picture in getattr(audio, "pictures", ())]
+        if tags:
+            _, special, _ = scheme_for(tags).apply(tags)
+            pictures.extend(value for field, value in special if field == "cover_art" and value)
+        for data in pictures:
+            if hashlib.md5(data).hexdigest() == self.md5:
+                located = CoverArt.locate(self.file_path, data, search_limit=getattr(tags, "size", None))
+                self.offset, self.data = located.offset, located.data
+                return data
+        raise ValueError(f"The cover art of {self.file_path} changed since it was extracted")
+
+    def to_dict(self) -> dict[str, Any]:
+        """Returns a JSON-serialisable representation of the reference."""
+        return {
+            "file_path": self.file_path,
+            "offset": self.offset,
+            "length": self.length,
+            "md5": self.md5,
+            "data": base64.b64encode(self.data).decode("ascii") if self.data is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, value: dict[str, Any]) -> "CoverArt":
+        """Recreates a reference from `to_dict` output."""
+        data = value.get("data")
+        return cls(
+            value["file_path"],
+            value["offset"],
+            value["length"],
+            value["md5"],
+            data=base64.b64decode(data) if data is not None else None,
+        )
@@ -0,0 +1,208 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from . import profiling
+from .cover_art import CoverArt
+from .image_manipulation import prepare_cover_art
+
+DEFAULT_STORE_DIR = "data/cover_art"
+
+
+def _extension(image_data: bytes) -> str:
+    """Guesses the file extension of image data from its signature."""
+    if image_data.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if image_data.startswith(b"\x89PNG"):
+        return ".png"
+    if image_data.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    return ".img"
+
+
+class CoverArtStore:
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR):
+        """
+        Content-addressed store of cover art and its processed variants.
+
+        Images are keyed by the MD5 of the original cover art, so tracks that
+        share a cover (EPs, label releases) share one stored original and one
+        copy of each variant, and each variant is only ever computed once.
+
+        Args:
+            store_dir (str): Directory holding the stored images.
+        """
+        self.store_dir = Path(store_dir)
+        self.paths: dict[tuple[str, str], Path] = {}
+
+    def _find(self, md5: str, variant: str) -> Path | None:
+        directory = self.store_dir / md5[:2]
+        if not directory.exists():
+            return None
+        return next(directory.glob(f"{md5}-{variant}.*"), None)
+
+    def _write(self, md5: str, variant: str, image_data: bytes) -> Path:
+        directory = self.store_dir / md5[:2]
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{md5}-{variant}{_extension(image_data)}"
+        # Unique per process, as workers may write the same shared cover at once, and
+        # hidden so that `_find` never returns a file that is still being written
+        tmp_path = directory / f".{path.name}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_data)
+        os.replace(tmp_path, path)
+        return path
+
+    def variant(
+        self, cover_art: CoverArt, variant: str, process: Callable[[bytes], bytes]
+    ) -> Path:
+        """
+        Returns the path of a processed variant of the cover art, creating it on first use.
+
+        Args:
+            cover_art (CoverArt): The cover art.
+            variant (str): Name of the variant, which must identify `process` and its parameters.
+            process (Callable[[bytes], bytes]): Creates the variant from the original image data.
+
+        Returns:
+            Path: The stored variant.
+        """
+        key = (cover_art.md5, variant)
+        path = self.paths.get(key)
+        if path is None:
+            path = self._find(cover_art.md5, variant)
+            if path is None:
+                original = self.read_original(cover_art)
+                with profiling.stage("lighten", size=len(original)):
+                    image_data = process(original)
+                path = self._write(cover_art.md5, variant, image_data)
+            self.paths[key] = path
+        return path
+
+    def original(self, cover_art: CoverArt) -> Path:
+        """
+        Returns the path of the stored original cover art, copying it from the audio file on first use.
+
+        `CoverArt.read` checks the image against its MD5, so a file whose tags were
+        rewritten since extraction never stores other bytes under that hash.
+        """
+        key = (cover_art.md5, "original")
+        path = self.paths.get(key) or self._find(cover_art.md5, "original")
+        if path is None:
+            path = self._write(cover_art.md5, "original", cover_art.read())
+        self.paths[key] = path
+        return path
+
+    def stored(self, md5: str) -> CoverArt | None:
+        """Returns a reference to the stored original cover art with the given MD5, or None if it is not stored."""
+        path = self.paths.get((md5, "original")) or self._find(md5, "original")
+        if path is None:
+            return None
+        self.paths[(md5, "original")] = path
+        return CoverArt(str(path), 0, path.stat().st_size, md5)
+
+    def read_original(self, cover_art: CoverArt) -> bytes:
+        """Reads the original image data from the store."""
+        with open(self.original(cover_art), "rb") as f:
+            return f.read()
+
+    def prepared(
+        self,
+        cover_art: CoverArt,
+        size: int | None = None,
+        threshold: float = 100.0,
+        factor: float = 1.5,
+        max_cycles: int = 3,
+    ) -> Path:
+        """
+        Returns the path of the cover art prepared for printing.
+
+        Args:
+            cover_art (CoverArt): The cover art.
+            size (int | None): Pixel size of the printed image, or None to keep the original size.
+            threshold (float): Brightness threshold (0-255) to classify as dark.
+            factor (float): Brightness enhancement factor applied per cycle.
+            max_cycles (int): Maximum number of cycles.
+
+        Returns:
+            Path: The stored, lightened and downsampled image.
+        """
+        return self.variant(
+            cover_art,
+            f"{size or 'full'}px-{threshold}-{factor}x{max_cycles}",
+            lambda image_data: prepare_cover_art(
+                image_data, threshold=threshold, factor=factor, max_cycles=max_cycles, size=size
+            ),
+        )
+
+
+def _prepare_in_worker(store_dir: str, cover_art: CoverArt, sizes: tuple[int, ...]) -> None:
+    store = CoverArtStore(store_dir)
+    for size in sizes:
+        store.prepared(cover_art, size=size)
+
+
+def prefetch_prepared(
+    cards: Iterable[dict[str, Any]],
+    store: CoverArtStore,
+    sizes: tuple[int, ...],
+    workers: int | None = None,
+    ahead: int | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yields cards in order while a process pool prepares the cover art of upcoming cards.
+
+    Each cover is submitted once while cards using it are in the window, and
+    at most `ahead` cards are buffered, so only the first card has to wait
+    for its images. Covers seen again later are found in the store.
+
+    Args:
+        cards (Iterable[dict]): The cards to draw.
+        store (CoverArtStore): The store the prepared images are written to.
+        sizes (tuple[int, ...]): Pixel sizes to prepare for every cover.
+        workers (int | None): Number of worker processes (default: CPU count).
+        ahead (int | None): Number of cards to prepare ahead (default: two per worker).
+
+    Yields:
+        dict: The cards, once their cover art is prepared.
+    """
+    workers = workers or os.cpu_count() or 1
+    ahead = ahead or workers * 2
+    cards = iter(cards)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        submitted: dict[str, Future] = {}
+        window: deque[tuple[dict[str, Any], Future | None]] = deque()
+
+        def fill() -> None:
+            while len(window) < ahead:
+                card = next(cards, None)
+                if card is None:
+                    return
+                cover_art = card.get("cover_art")
+                future = None
+                if isinstance(cover_art, CoverArt):
+                    future = submitted.get(cover_art.md5)
+                    if future is None:
+                        future = executor.submit(
+                            _prepare_in_worker, str(store.store_dir), cover_art, sizes
+                        )
+                        submitted[cover_art.md5] = future
+                window.append((card, future))
+
+        fill()
+        while window:
+            card, future = window.popleft()
+            fill()
+            if future is not None:
+                try:
+                    future.result()
+                except Exception as e:
+                    # Left for the canvas thread, which reports it as it draws
+                    print(f"Error preparing cover art for {card.get('file')}: {e}")
+                # Only covers in the window are tracked, later cards sharing one find it in the store
+                md5 = card["cover_art"].md5
+                if submitted.get(md5) is future:
+                    del submitted[md5]
+            yield card
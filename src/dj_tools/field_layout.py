@@ -1,3 +1,6 @@
+from typing import NamedTuple
+
+
 class FieldLayout:
     def __init__(
         self,
@@ -37,3 +40,89 @@ class FieldLayout:
         self.prefix = prefix
         self.width = width
         self.max_lines = max_lines
+
+
+class CompiledField(NamedTuple):
+    """A field layout with its justification parsed, ready to be drawn on every card."""
+
+    field_name: str
+    x: float
+    y: float
+    justification: str
+    between: tuple[str, str] | None
+    font: str
+    font_size: int
+    prefix: str
+    width: float
+    max_lines: int
+
+
+class LayoutPlan(NamedTuple):
+    """Fields of each side of a card, in drawing order."""
+
+    front: tuple[CompiledField, ...]
+    back: tuple[CompiledField, ...]
+
+
+def _compile_field(field: FieldLayout) -> CompiledField:
+    justification = field.justification
+    between = None
+    if justification.startswith("between:"):
+        left, _, right = justification.split(":", 1)[1].partition("&")
+        if not left or not right:
+            raise ValueError(
+                f"Field {field.field_name}: expected 'between:<left>&<right>', got {justification!r}"
+            )
+        justification, between = "between", (left, right)
+    elif justification not in ("left", "center", "right"):
+        raise ValueError(f"Field {field.field_name}: unknown justification {justification!r}")
+    return CompiledField(
+        field_name=field.field_name,
+        x=field.x,
+        y=field.y,
+        justification=justification,
+        between=between,
+        font=field.font,
+        font_size=field.font_size,
+        prefix=field.prefix,
+        width=field.width,
+        max_lines=field.max_lines,
+    )
+
+
+def _order_side(fields: list[CompiledField], side: str) -> tuple[CompiledField, ...]:
+    """Orders fields so that 'between' fields are drawn after the fields they sit between."""
+    edges = {f.field_name for f in fields if f.justification in ("left", "right")}
+    for field in fields:
+        for name in field.between or ():
+            if name not in edges:
+                raise ValueError(
+                    f"Field {field.field_name} on the {side} is placed between {name}, "
+                    f"which is not a left or right justified field on the same side"
+                )
+    # Left and right fields never depend on others, so drawing them first resolves every
+    # dependency while keeping the configured order within each group.
+    return tuple(
+        [f for f in fields if f.between is None] + [f for f in fields if f.between is not None]
+    )
+
+
+def compile_layouts(layouts: list[FieldLayout]) -> LayoutPlan:
+    """
+    Compiles layout instructions once, before any card is drawn.
+
+    Args:
+        layouts (list[FieldLayout]): Layout instructions for fields.
+
+    Returns:
+        LayoutPlan: The fields of each side in drawing order, with parsed justification.
+    """
+    sides: dict[str, list[CompiledField]] = {"front": [], "back": []}
+    for field in layouts:
+        if field.side not in sides:
+            raise ValueError(f"Field {field.field_name}: unknown side {field.side!r}")
+        sides[field.side].append(_compile_field(field))
+    return LayoutPlan(
+        front=_order_side(sides["front"], "front"),
+        back=_order_side(sides["back"], "back"),
+    )
@@ -1,93 +1,123 @@
 from PIL import Image, ImageEnhance
+from functools import lru_cache
 from io import BytesIO
 import numpy as np
 import qrcode
 
+# QR version of the search text, fitting the 49 characters kept by `_make_qr`
+SEARCH_QR_VERSION = 4
 
-def is_dark(image_data: bytes, threshold: float = 100.0) -> bool:
-    """
-    Determines if an image is dark based on its average brightness.
-
-    Args:
-        image_data (bytes): The binary image data.
-        threshold (float): Brightness threshold (0-255) to classify as dark.
-
-    Returns:
-        bool: True if the image is dark, False otherwise.
-    """
-    # Load the image from binary data
-    image = Image.open(BytesIO(image_data)).convert("RGB")
 
-    # Convert to a NumPy array for pixel-level manipulation
-    pixels = np.array(image)
-
-    # Calculate perceived brightness for each pixel
+def _brightness(pixels: np.ndarray) -> float:
+    """Average perceived brightness (0-255) of an RGB pixel array."""
     brightness = (
         0.299 * pixels[..., 0] + 0.587 * pixels[..., 1] + 0.114 * pixels[..., 2]
     )
-    avg_brightness = brightness.mean()
-
-    return avg_brightness < threshold
+    return float(brightness.mean())
 
 
-def lighten_image(image_data: bytes, factor: float = 1.5) -> bytes:
+def prepare_cover_art(
+    image_data: bytes,
+    threshold: float = 100.0,
+    factor: float = 1.5,
+    max_cycles: int = 3,
+    thumbnail_size: int = 128,
+    size: int | None = None,
+) -> bytes:
     """
-    Lightens an image by a specified factor.
+    Lightens a dark image and downsamples it for printing in a single pass.
+
+    Equivalent to lightening by `factor` while the image is darker than
+    `threshold`, at most `max_cycles` times, but the brightness is measured on
+    a thumbnail (decoded at reduced size where the format allows), the total
+    factor is derived from it, and the image is enhanced and re-encoded once.
 
     Args:
         image_data (bytes): The binary image data.
-        factor (float): Brightness enhancement factor (>1.0 for brighter, <1.0 for darker).
+        threshold (float): Brightness threshold (0-255) to classify as dark.
+        factor (float): Brightness enhancement factor applied per cycle.
+        max_cycles (int): Maximum number of cycles.
+        thumbnail_size (int): Size of the thumbnail used to measure brightness.
+        size (int | None): Downsample the image to fit within size x size pixels.
 
     Returns:
-        bytes: The binary data of the lightened image.
+        bytes: The binary data of the image, unchanged if it was neither dark nor too large.
     """
-    # Load the image from binary data
+    thumbnail = Image.open(BytesIO(image_data))
+    thumbnail.draft("RGB", (thumbnail_size, thumbnail_size))
+    thumbnail = thumbnail.convert("RGB")
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+    pixels = np.asarray(thumbnail, dtype=np.float32)
+
+    # Brightening scales every channel and clips at white, so the brightness
+    # after n cycles can be computed from the thumbnail directly
+    cycles = 0
+    while cycles < max_cycles and _brightness(np.minimum(pixels * factor**cycles, 255)) < threshold:
+        cycles += 1
     image = Image.open(BytesIO(image_data))
-
-    # Enhance the brightness
-    enhancer = ImageEnhance.Brightness(image)
-    lightened_image = enhancer.enhance(factor)
-
-    # Save the lightened image to a BytesIO object
-    lightened_data = BytesIO()
-    lightened_image.save(lightened_data, format=image.format)
-    lightened_data.seek(0)
-
-    return lightened_data.getvalue()
-
-
-# Generate QR code for text
-def generate_qr_code(text: str, size: int = 256) -> BytesIO:
-    """
-    Generates a QR code for the given text with a fixed resolution.
-
-    Args:
-        text (str): The text to encode in the QR code.
-        size (int): The desired pixel size of the QR code (default: 256x256).
-
-    Returns:
-        BytesIO: A file-like object containing the QR code image.
-    """
+    resize = size is not None and max(image.size) > size
+    if cycles == 0 and not resize:
+        return image_data
+
+    image_format = image.format
+    if resize:
+        image.draft(image.mode, (size, size))
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        image_format = "JPEG" if image.mode in ("RGB", "L", "CMYK") else "PNG"
+    if cycles > 0:
+        image = ImageEnhance.Brightness(image).enhance(factor**cycles)
+
+    prepared_data = BytesIO()
+    if image_format == "JPEG":
+        image.save(prepared_data, format=image_format, quality=90)
+    else:
+        image.save(prepared_data, format=image_format)
+    return prepared_data.getvalue()
+
+
+def _make_qr(text: str, version: int = SEARCH_QR_VERSION) -> qrcode.QRCode:
     # Version 4 (33x33 grid) with error correction H
     # Max of 50 alpha-numeric characters
     # see: https://www.qrcode.com/en/about/version.html
+    # Shorter texts may start from a smaller version, which grows to fit the text
     qr = qrcode.QRCode(
-        version=4,
+        version=version,
         error_correction=qrcode.constants.ERROR_CORRECT_H,
         box_size=10,  # Base size of each box in the QR code
         border=0,  # Minimum border size (default is 4)
     )
     qr.add_data(text[:49])
     qr.make(fit=True)
+    return qr
 
-    # Render the QR code to an image
-    qr_image = qr.make_image(fill_color="black", back_color="white")
 
-    # Resize the image to ensure fixed resolution
-    qr_image = qr_image.resize((size, size))
+@lru_cache(maxsize=4096)
+def qr_modules(
+    text: str, version: int = SEARCH_QR_VERSION
+) -> tuple[int, tuple[tuple[int, int, int], ...]]:
+    """
+    Computes the dark modules of the QR code for the given text, memoised by text.
 
-    # Save the QR code to a BytesIO object
-    qr_buffer = BytesIO()
-    qr_image.save(qr_buffer, format="PNG")
-    qr_buffer.seek(0)  # Reset file pointer to the beginning
-    return qr_buffer
+    Args:
+        text (str): The text to encode in the QR code.
+        version (int): The smallest QR version to use.
+
+    Returns:
+        tuple: The number of modules per side, and the horizontal runs of dark
+            modules as (x, y, length) with y counted from the bottom row.
+    """
+    matrix = _make_qr(text, version).get_matrix()
+    modules = len(matrix)
+    runs = []
+    for row_index, row in enumerate(matrix):
+        y = modules - 1 - row_index
+        x = 0
+        while x < modules:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < modules and row[x]:
+                x += 1
+            runs.append((start, y, x - start))
+    return modules, tuple(runs)
@@ -0,0 +1,144 @@
+import argparse
+import os
+from typing import Any, Iterable, Iterator
+
+from . import profiling
+from .metadata_cache import DEFAULT_CACHE_PATH, MetadataCache
+from .metadata_extraction import extract_metadata, extract_metadata_parallel
+from .scan_manifest import ScanManifest
+from .tag_mapping import report_unextracted
+from .utils import DEFAULT_EXCLUDE, walk_library
+from .version_history import VersionHistory, item_fingerprint
+
+
+def add_scan_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options selecting and extracting the library files to a command."""
+    parser.add_argument("--library", default="/Users/epinzur/Desktop/Music/Traktor/dnb")
+    parser.add_argument("--history", default="data/track_history")
+    parser.add_argument("--manifest", default="data/scan_manifest.json")
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="Extract every file, ignoring the scan manifest from previous runs.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for metadata extraction.",
+    )
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the metadata cache.",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        help="Only scan file names matching this glob (repeatable).",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        help=f"Skip directories and files matching this glob (repeatable, default: {DEFAULT_EXCLUDE}).",
+    )
+
+
+class LibraryScan:
+    def __init__(
+        self,
+        library: str,
+        manifest: ScanManifest,
+        cache: MetadataCache | None = None,
+        workers: int = 1,
+        include: Iterable[str] | None = None,
+        exclude: Iterable[str] | None = None,
+    ):
+        """
+        The tracks of a library that changed since the last run, extracted lazily.
+
+        Iterating walks the library, skips files the manifest knows are
+        unchanged, extracts the rest and records them in the manifest. Only
+        tags and content hashes are read, cover art is never decoded.
+
+        Args:
+            library (str): The path to the library folder.
+            manifest (ScanManifest): Manifest of the files processed by previous runs.
+            cache (MetadataCache | None): Cache of previously extracted metadata.
+            workers (int): Number of processes used for metadata extraction.
+            include (Iterable[str] | None): If set, only file names matching one of these globs are scanned.
+            exclude (Iterable[str] | None): Globs for directory and file names to skip (default: DEFAULT_EXCLUDE).
+        """
+        self.library = library
+        self.manifest = manifest
+        self.cache = cache
+        self.workers = workers
+        self.include = include
+        self.exclude = exclude if exclude is not None else DEFAULT_EXCLUDE
+        self.scanned = 0
+        self.skipped = 0
+        self.pending: dict[str, os.stat_result] = {}
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "LibraryScan":
+        """Creates a scan from the options added by `add_scan_arguments`."""
+        return cls(
+            args.library,
+            ScanManifest(args.manifest, full_rescan=args.full_rescan),
+            cache=None if args.no_cache else MetadataCache(args.cache),
+            workers=args.workers,
+            include=args.include,
+            exclude=args.exclude,
+        )
+
+    def _changed_files(self) -> Iterator[str]:
+        for file in walk_library(self.library, include=self.include, exclude=self.exclude):
+            self.scanned += 1
+            try:
+                stat = os.stat(file)
+            except OSError as e:
+                # Moved or deleted since the walk listed it, e.g. by a sync client
+                print(f"Error reading {file}: {e}")
+                continue
+            if self.manifest.is_unchanged(file, stat):
+                self.skipped += 1
+                continue
+            self.pending[file] = stat
+            yield file
+
+    def __iter__(self) -> Iterator[tuple[dict[str, Any], dict[str, Any]]]:
+        """
+        Yields the metadata of each changed track with cover art, and its history item.
+        """
+        files = profiling.iterate("walk", self._changed_files())
+        if self.workers > 1:
+            results = extract_metadata_parallel(files, workers=self.workers, cache=self.cache)
+        else:
+            results = extract_metadata(files, cache=self.cache)
+
+        for file, metadata, error in profiling.iterate("extract", results):
+            stat = self.pending.pop(file)
+            profiling.add_bytes("extract", stat.st_size)
+            if error is not None:
+                print(f"Error extracting metadata from {file}: {error}")
+                continue
+
+            # if metadata.get("stars", 0) < 4:
+            #     continue
+
+            if not metadata.get("cover_art"):
+                self.manifest.record(file, stat, None)
+                continue
+
+            item = VersionHistory.convert_metadata(metadata)
+            self.manifest.record(file, stat, item_fingerprint(item))
+            yield metadata, item
+
+    def close(self) -> None:
+        """Reports the files skipped, the metadata cache use and unextracted tags, and closes the cache."""
+        print(f"Skipped {self.skipped} unchanged files of {self.scanned}")
+        if self.cache is not None:
+            print(f"Metadata cache: {self.cache.hits} hits, {self.cache.misses} misses")
+            self.cache.close()
+        report_unextracted()
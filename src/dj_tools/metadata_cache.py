@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any
+
+from mutagen.id3 import ID3TimeStamp
+
+from .cover_art import CoverArt
+from .metadata_extraction import EXTRACTION_VERSION, extract_mp3_metadata
+
+CACHE_SCHEMA_VERSION = 1
+
+DEFAULT_CACHE_PATH = "data/metadata_cache.sqlite"
+# Number of pending writes that triggers a flush, each flush is one transaction
+FLUSH_SIZE = 256
+
+
+def encode_metadata(metadata: dict[str, Any]) -> str:
+    """Encodes extracted metadata as JSON, including its cover art reference and dates."""
+    def default(value: Any) -> Any:
+        if isinstance(value, CoverArt):
+            return {"__cover_art__": value.to_dict()}
+        if isinstance(value, ID3TimeStamp):
+            # Dates are only ever compared, saved and printed as text.
+            return value.text
+        raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+    return json.dumps(metadata, default=default)
+
+
+def decode_metadata(encoded: str) -> dict[str, Any]:
+    """Decodes metadata encoded by `encode_metadata`."""
+    def object_hook(value: dict[str, Any]) -> Any:
+        if "__cover_art__" in value:
+            return CoverArt.from_dict(value["__cover_art__"])
+        return value
+
+    return json.loads(encoded, object_hook=object_hook)
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        cache_path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 100_000,
+        prepare: bool = True,
+    ):
+        """
+        On-disk cache of cleaned metadata, keyed by path, size and mtime.
+
+        Entries written by an older `EXTRACTION_VERSION` are dropped on open,
+        and the least recently used entries are evicted beyond `max_entries`.
+        Lookups and new entries are written in batches, so concurrent
+        processes rarely wait for the database's write lock.
+
+        Args:
+            cache_path (str): Path of the SQLite database.
+            max_entries (int): Maximum number of entries kept after `close`.
+            prepare (bool): Create the schema and drop outdated entries. Worker processes
+                opening a cache the parent process already prepared skip this.
+        """
+        self.cache_path = Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._used: dict[str, float] = {}
+        self._new: dict[str, tuple[Any, ...]] = {}
+        self.connection = sqlite3.connect(self.cache_path, timeout=30)
+        if prepare:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self.connection:
+            (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+            if version != CACHE_SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS entries")
+                self.connection.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    extraction_version INTEGER NOT NULL,
+                    metadata TEXT NOT NULL,
+                    cover_art_md5 TEXT,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+            )
+            self.connection.execute(
+                "DELETE FROM entries WHERE extraction_version != ?", (EXTRACTION_VERSION,)
+            )
+
+    def get(self, file_path: str, stat: os.stat_result | None = None) -> dict[str, Any] | None:
+        """
+        Looks up the cached metadata for a file.
+
+        Args:
+            file_path (str): The path to the file.
+            stat (os.stat_result | None): The current stat of the file, if already known.
+
+        Returns:
+            dict | None: The cleaned metadata, or None if the file changed or is not cached.
+        """
+        stat = stat or os.stat(file_path)
+        row = self.connection.execute(
+            "SELECT metadata FROM entries WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (file_path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[file_path] = time.time()
+        if len(self._used) >= FLUSH_SIZE:
+            self.flush()
+        return decode_metadata(row[0])
+
+    def put(self, file_path: str, stat: os.stat_result, metadata: dict[str, Any]) -> None:
+        """
+        Stores the cleaned metadata for a file.
+
+        Args:
+            file_path (str): The path to the file.
+            stat (os.stat_result): The stat of the file taken before extraction.
+            metadata (dict): The cleaned metadata.
+        """
+        cover_art = metadata.get("cover_art")
+        self._new[file_path] = (
+            file_path,
+            stat.st_size,
+            stat.st_mtime_ns,
+            EXTRACTION_VERSION,
+            encode_metadata(metadata),
+            cover_art.md5 if isinstance(cover_art, CoverArt) else None,
+            time.time(),
+        )
+        if len(self._new) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the pending entries and lookup times in a single transaction."""
+        if not self._new and not self._used:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", self._new.values()
+            )
+            self.connection.executemany(
+                "UPDATE entries SET last_used = ? WHERE path = ?",
+                [(used, path) for path, used in self._used.items()],
+            )
+        self._new.clear()
+        self._used.clear()
+
+    def extract(self, file_path: str, stat: os.stat_result | None = None) -> dict[str, Any]:
+        """
+        Returns the metadata for a file, extracting and caching it on a miss.
+
+        Extraction errors are raised rather than printed, and are never cached.
+
+        Args:
+            file_path (str): The path to the MP3 file.
+            stat (os.stat_result | None): The current stat of the file, if already known.
+
+        Returns:
+            dict: The cleaned metadata.
+        """
+        stat = stat or os.stat(file_path)
+        metadata = self.get(file_path, stat)
+        if metadata is None:
+            metadata = extract_mp3_metadata(file_path, raise_errors=True)
+            self.put(file_path, stat, metadata)
+        return metadata
+
+    def evict(self) -> int:
+        """Removes the least recently used entries beyond `max_entries`, returning the number removed."""
+        self.flush()
+        with self.connection:
+            cursor = self.connection.execute(
+                """
+                DELETE FROM entries WHERE path IN (
+                    SELECT path FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
+
+    def __enter__(self) -> "MetadataCache":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -1,130 +1,246 @@
 import os
-from typing import Any
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import batched
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
 
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, POPM, UFID
+import mutagen
 
+from .cover_art import CoverArt
+from .mp3_header import read_mp3_header
+from .tag_mapping import scheme_for, unextracted_tags
 from .key_conversion import (
     convert_long_key_to_camelot,
     convert_open_key_to_camelot,
 )
 
+if TYPE_CHECKING:
+    from .metadata_cache import MetadataCache
 
-def extract_mp3_metadata(file_path: str) -> dict[str, Any]:
+
+# Bump when the extraction or cleaning rules change, to invalidate cached metadata.
+EXTRACTION_VERSION = 3
+
+ExtractionResult = tuple[str, dict[str, Any] | None, str | None]
+
+
+def extract_mp3_metadata(file_path: str, raise_errors: bool = False) -> dict[str, Any]:
     """
     Extracts metadata and cover art from an MP3 file.
 
     Args:
         file_path (str): The path to the MP3 file.
+        raise_errors (bool): Raise read errors instead of printing them.
 
     Returns:
         dict: A dictionary containing the title, artist, album, and cover art.
     """
+    return extract_audio_metadata(file_path, raise_errors=raise_errors)
+
+
+def extract_audio_metadata(file_path: str, raise_errors: bool = False) -> dict[str, Any]:
+    """
+    Extracts metadata and cover art from an audio file with any tag format in `tag_mapping`.
 
-    keys_to_skip = [
-        "APIC",  # Attached (or linked) Picture
-        "PRIV",  # Private frame
-        "TENC",  # Encoder
-        # "TSRC", # International Standard Recording Code (ISRC)
-        "TSSE",  # Encoder settings
-        "UFID",  # Unique file identifier
-        "WOAF",  # Official File Information
-        "WPUB",  # Official Publisher Information
-        "TRCK",  # Track Number
-        "POPM",  # Popularimeter
-        "GEOB",  # General Encapsulated Object (serato overview)
-        "WCOM",  # Commercial Information
-        "RVA2",  # Relative volume adjustment (serato gain)
-        "TPOS",  # Part of set
-        "TCMP",  # iTunes Compilation Flag
-        "TCOM",  # Composer
-        "TXXX:ALBUM ARTIST",
-        "TXXX:SERATO_PLAYCOUNT",
-        "TXXX:TRACK_URL",
-        "TXXX:LABEL_URL",
-        "TXXX:FILEOWNER",
-        # "TXXX:ISRC",
-        "TXXX:BPM",
-        "TXXX:YEAR",
-        "TXXX:FILETYPE",
-        "TXXX:INITIAL_KEY",
-        "TXXX:RELEASE_TIME",
-        "TXXX:RECORDING_DATE",
-        "TXXX:ORGANIZATION",
-    ]
+    MP3 files are read from their tags and VBR header only (see `read_mp3_header`),
+    other formats (FLAC, M4A, AIFF, ...) are detected by mutagen, and the tags are
+    mapped by the matching scheme.
 
+    Args:
+        file_path (str): The path to the audio file.
+        raise_errors (bool): Raise read errors instead of printing them.
+
+    Returns:
+        dict: A dictionary containing the title, artist, album, and cover art.
+    """
     metadata = {
-        "cover_art": None,  # Will hold binary data of the cover art
+        "cover_art": None,  # Will hold a CoverArt reference to the cover art
     }
 
     try:
-        audio = MP3(file_path, ID3=ID3)  # Load MP3 with ID3 tags
-        duration_seconds = (
-            int(audio.info.length) if audio.info and audio.info.length else None
-        )
+        if file_path.lower().endswith(".mp3"):
+            tags, length, head = read_mp3_header(file_path)
+            pictures = ()
+        else:
+            audio = mutagen.File(file_path)
+            if audio is None:
+                raise ValueError("Unsupported audio format")
+            tags, length, head = audio.tags, audio.info.length if audio.info else None, None
+            # FLAC stores pictures outside of its tags
+            pictures = getattr(audio, "pictures", ())
+        duration_seconds = int(length) if length else None
         if duration_seconds is not None:
             minutes = duration_seconds // 60
             seconds = duration_seconds % 60
             metadata["duration"] = f"{minutes}:{seconds:02d}"
 
-        tags: dict[str, Any] = audio.tags
         if tags:
+            fields, special, unknown = scheme_for(tags).apply(tags)
+            unextracted_tags.update(unknown)
 
-            def get_tag(tag: str) -> str | None:
-                if tag in tags:
-                    return tags.pop(tag).text[0]
-                return None
-
-            # Extract common metadata
             metadata["file"] = os.path.basename(file_path)
-            metadata["id"] = get_tag("TSRC") or get_tag("TXXX:ISRC")
-            metadata["title"] = get_tag("TIT2")
-            metadata["artist"] = get_tag("TPE1") or get_tag("TXXX:ALBUM ARTIST")
-            metadata["additional_artists"] = get_tag("TPE2")
-            metadata["original_artist"] = get_tag("TOPE")
-            metadata["remixer"] = get_tag("TPE4") or get_tag("TXXX:TraktorRemixer")
-            metadata["album"] = get_tag("TALB")
-            metadata["original_album"] = get_tag("TOAL")
-            metadata["genre"] = get_tag("TCON")
-            metadata["label"] = get_tag("TIT1") or get_tag("TXXX:LABEL")
-            metadata["publisher"] = get_tag("TPUB") or get_tag("TXXX:ORGANIZATION")
-            metadata["file_type"] = get_tag("TFLT") or get_tag("TXXX:FILETYPE")
-            metadata["release_year"] = get_tag("TDRL") or get_tag("TXXX:YEAR")
-            metadata["release_date"] = get_tag("TDOR") or get_tag("TXXX:RELEASE_TIME")
-            metadata["recording_date"] = get_tag("TDRC") or get_tag(
-                "TXXX:RECORDING_DATE"
-            )
-            metadata["starting_key"] = get_tag("TKEY") or get_tag("TXXX:INITIAL_KEY")
-            metadata["user_comment"] = get_tag("COMM::eng") or get_tag("TXXX:COMMENT")
-            metadata["user_comment_2"] = get_tag("COMM:ID3v1 Comment:eng")
-            metadata["bpm"] = get_tag("TBPM") or get_tag("TXXX:BPM")
-
-            for key, value in tags.items():
-                skip_key = False
-                for skip in keys_to_skip:
-                    if skip in key:
-                        skip_key = True
-                        continue
-                if skip_key:
+            metadata.update(fields)
+
+            special.extend(("cover_art", picture.data) for picture in pictures)
+            for field, value in special:
+                if value is None:
                     continue
-                print(f"unextracted tag: '{key}', value: '{value}'")
-
-            for tag in tags.values():
-                if isinstance(tag, APIC):  # APIC contains cover art
-                    metadata["cover_art"] = tag.data
-                elif isinstance(tag, POPM):  # Popularimeter
-                    metadata["rating"] = tag.rating
-                elif isinstance(tag, UFID):  # Unique file identifier.
-                    ufid = tag.owner.strip()
-                    if len(ufid) > 0:
-                        metadata["id"] = ufid
+                if field == "cover_art":
+                    metadata["cover_art"] = CoverArt.locate(
+                        file_path, value, search_limit=getattr(tags, "size", None), head=head
+                    )
+                else:
+                    metadata[field] = value
 
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting metadata from {file_path}: {e}")
 
     return clean_metadata(metadata)
 
 
+def extract_metadata(
+    file_paths: Iterable[str], cache: "MetadataCache | None" = None
+) -> Iterator[ExtractionResult]:
+    """
+    Extracts metadata from many MP3 files, reporting errors per file.
+
+    Args:
+        file_paths (Iterable[str]): Paths to the MP3 files.
+        cache (MetadataCache | None): Read through this metadata cache.
+
+    Yields:
+        tuple: (file path, cleaned metadata or None, error message or None).
+    """
+    for file_path in file_paths:
+        try:
+            if cache is not None:
+                metadata = cache.extract(file_path)
+            else:
+                metadata = extract_mp3_metadata(file_path, raise_errors=True)
+            yield (file_path, metadata, None)
+        except Exception as e:
+            yield (file_path, None, f"{type(e).__name__}: {e}")
+
+
+# The metadata cache of a worker process, opened once by `_init_worker`
+_worker_cache: "MetadataCache | None" = None
+
+
+def _init_worker(cache_path: str | None) -> None:
+    global _worker_cache
+    if cache_path is not None:
+        # Imported here as metadata_cache depends on this module.
+        from .metadata_cache import MetadataCache
+
+        # The parent process already created the schema and dropped outdated entries
+        _worker_cache = MetadataCache(cache_path, prepare=False)
+
+
+def _extract_chunk(
+    file_paths: tuple[str, ...],
+) -> tuple[list[ExtractionResult], Counter[str], tuple[int, int]]:
+    """Extracts a chunk of files in a worker process, with the unextracted tags and cache hits and misses."""
+    unextracted_tags.clear()
+    cache = _worker_cache
+    if cache is None:
+        return list(extract_metadata(file_paths)), Counter(unextracted_tags), (0, 0)
+    hits, misses = cache.hits, cache.misses
+    results = list(extract_metadata(file_paths, cache=cache))
+    cache.flush()
+    return results, Counter(unextracted_tags), (cache.hits - hits, cache.misses - misses)
+
+
+def extract_metadata_parallel(
+    file_paths: Iterable[str],
+    workers: int | None = None,
+    chunk_size: int = 16,
+    ordered: bool = True,
+    cache: "MetadataCache | None" = None,
+) -> Iterator[ExtractionResult]:
+    """
+    Extracts metadata from many MP3 files across a process pool.
+
+    Files are submitted in chunks, with at most two chunks in flight per worker,
+    so `file_paths` can be a lazy iterable.
+
+    Args:
+        file_paths (Iterable[str]): Paths to the MP3 files.
+        workers (int | None): Number of worker processes (default: CPU count).
+        chunk_size (int): Number of files sent to a worker at a time.
+        ordered (bool): Yield results in input order instead of completion order.
+        cache (MetadataCache | None): Read through this metadata cache, which also
+            counts the hits and misses of the workers.
+
+    Yields:
+        tuple: (file path, cleaned metadata or None, error message or None).
+    """
+    workers = workers or os.cpu_count() or 1
+    if cache is not None:
+        # Workers write to the database too
+        cache.flush()
+    cache_path = None if cache is None else str(cache.cache_path)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(cache_path,)
+    ) as executor:
+        max_in_flight = workers * 2
+        chunks = batched(file_paths, chunk_size)
+        in_flight: deque[Future] = deque()
+
+        def submit_next() -> bool:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            in_flight.append(executor.submit(_extract_chunk, chunk))
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+
+        while in_flight:
+            if ordered:
+                done = [in_flight.popleft()]
+            else:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                done = [future for future in in_flight if future in finished]
+                for future in done:
+                    in_flight.remove(future)
+            for future in done:
+                submit_next()
+                results, unextracted, (hits, misses) = future.result()
+                unextracted_tags.update(unextracted)
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+                yield from results
+
+
+def search_text(title: str, artist: str) -> str:
+    """
+    Builds the text searched for in the DJ software, as encoded in the QR codes.
+
+    Args:
+        title (str): The track title.
+        artist (str): The track artist.
+
+    Returns:
+        str: The lower case words of the title and artist, without punctuation and filler words.
+    """
+    search = (title + " " + artist).lower()
+
+    for char in ["(", ")", ",", "-", "&", "!", "'s"]:
+        search = search.replace(char, "")
+
+    words = []
+    for word in search.split():
+        if word in ["mix", "of", "a", "feat.", "i", "the"]:
+            continue
+        words.append(word)
+
+    return " ".join(words)
+
+
 def clean_metadata(metadata: dict[str, Any]):
     keys_to_remove = {key for key, value in metadata.items() if value is None}
 
@@ -199,20 +315,7 @@ def clean_metadata(metadata: dict[str, Any]):
             convert_long_key_to_camelot(metadata["starting_key"])
         )
 
-    search: str = metadata.get("title", "") + " " + metadata.get("artist", "")
-
-    search = search.lower()
-
-    for char in ["(", ")", ",", "-", "&", "!", "'s"]:
-        search = search.replace(char, "")
-
-    words = []
-    for word in search.split():
-        if word in ["mix", "of", "a", "feat.", "i", "the"]:
-            continue
-        words.append(word)
-
-    metadata["search"] = " ".join(words)
+    metadata["search"] = search_text(metadata.get("title", ""), metadata.get("artist", ""))
 
     metadata["key_bpm"] = (
         metadata.get("starting_key", "") + " - " + metadata.get("bpm", "")
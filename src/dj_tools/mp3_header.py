@@ -0,0 +1,97 @@
+import io
+import os
+from typing import NamedTuple
+
+from mutagen.id3 import ID3, BitPaddedInt, ID3NoHeaderError
+from mutagen.mp3 import HeaderNotFoundError, MPEGFrame, MPEGInfo, iter_sync
+
+# First read of a file, enough for most ID3 tags without cover art
+HEAD_SIZE = 16 * 1024
+# Read after the ID3v2 tags to find the first MPEG frame and its Xing/Info, LAME or VBRI header
+FRAME_PROBE_SIZE = 4 * 1024
+# An ID3v1 tag, plus the bytes mutagen reads to tell it apart from an APEv2 footer
+TAIL_SIZE = 128 + 3
+
+
+class MP3Header(NamedTuple):
+    """Tags and length of an MP3 file, read from the start and end of the file only."""
+
+    tags: ID3 | None
+    length: float | None
+    head: bytes  # The first bytes of the file, covering the ID3v2 tags
+
+
+def _audio_start(f: io.BufferedReader, head: bytes) -> tuple[int, bytes]:
+    """Skips the ID3v2 tags at the start of a file, reading more of it as needed."""
+    offset = 0
+    # WMP writes multiple ID3 tags, so skip as many as there are (like mutagen)
+    while True:
+        if len(head) < offset + 10:
+            head += f.read(offset + 10 - len(head))
+        header = head[offset:offset + 10]
+        if len(header) < 10 or header[:3] != b"ID3":
+            return offset, head
+        size = BitPaddedInt(header[6:10])
+        if size <= 0:
+            return offset, head
+        offset += 10 + size
+
+
+def _vbr_length(head: bytes, audio_start: int) -> float | None:
+    """The length in the Xing/Info (with LAME delay and padding) or VBRI header of the first MPEG frame."""
+    fileobj = io.BytesIO(head)
+    fileobj.seek(audio_start)
+    for _ in iter_sync(fileobj, len(head) - audio_start):
+        try:
+            frame = MPEGFrame(fileobj)
+        except HeaderNotFoundError:
+            continue
+        # Frames without a VBR header are sketchy and have no length
+        if frame.sketchy:
+            return None
+        return getattr(frame, "length", None)
+    return None
+
+
+def read_mp3_header(file_path: str) -> MP3Header:
+    """
+    Reads the tags and length of an MP3 file without scanning its audio.
+
+    Only the ID3v2 tags, the first MPEG frame and the ID3v1 tag at the end
+    are read. The length comes from the Xing/Info, LAME or VBRI header, as
+    mutagen computes it. Files without one fall back to mutagen's MPEG frame
+    probing, which estimates the length from the bitrate and file size. The
+    TLEN frame is ignored, as by mutagen, so the length is the same as
+    mutagen's.
+
+    Args:
+        file_path (str): The path to the MP3 file.
+
+    Returns:
+        MP3Header: The tags (None if the file has none), the length in seconds and the head of the file.
+    """
+    with open(file_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = f.read(HEAD_SIZE)
+        audio_start, head = _audio_start(f, head)
+        if len(head) < audio_start + FRAME_PROBE_SIZE:
+            head += f.read(audio_start + FRAME_PROBE_SIZE - len(head))
+
+        # The ID3v1 tag is read as mutagen reads it, from the end of the head and tail
+        if file_size - len(head) > TAIL_SIZE:
+            f.seek(-TAIL_SIZE, os.SEEK_END)
+            tail = f.read(TAIL_SIZE)
+        else:
+            tail = f.read()
+        try:
+            tags = ID3(io.BytesIO(head + tail))
+        except ID3NoHeaderError:
+            tags = None
+
+        length = _vbr_length(head, audio_start)
+        if length is None:
+            f.seek(0)
+            info = MPEGInfo(f, tags.size if tags is not None else None)
+            length = info.length
+
+    return MP3Header(tags, length, head)
@@ -0,0 +1,108 @@
+import argparse
+import json
+from typing import Any
+
+from .library_scan import LibraryScan, add_scan_arguments
+from .version_history import NON_CONTENT_KEYS, VersionHistory
+
+
+def _text(value: Any) -> str | None:
+    """The value as compared by fingerprints, ignoring floats that Parquet made of integer columns."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def field_changes(
+    item: dict[str, Any], previous: dict[str, Any] | None
+) -> dict[str, tuple[str | None, str | None]]:
+    """
+    Lists the fields of an item that differ from its previously printed version.
+
+    Args:
+        item (dict): Item as returned by `VersionHistory.convert_metadata`.
+        previous (dict | None): The previously printed version, if any.
+
+    Returns:
+        dict: The old and new value of each changed field.
+    """
+    previous = previous or {}
+    changes = {}
+    for key in sorted(set(item) | set(previous)):
+        if key in NON_CONTENT_KEYS:
+            continue
+        old, new = _text(previous.get(key)), _text(item.get(key))
+        if old != new:
+            changes[key] = (old, new)
+    return changes
+
+
+def plan_new_versions(scan: LibraryScan, history_dir: str) -> list[dict[str, Any]]:
+    """
+    Finds the versions a run of `cards` would print, from tags and content hashes only.
+
+    Args:
+        scan (LibraryScan): The changed tracks of the library.
+        history_dir (str): Directory holding the Parquet snapshots.
+
+    Returns:
+        list[dict]: For each new version its id, rev, title, artist and field changes.
+    """
+    items = [item for _, item in scan]
+    history = VersionHistory(history_dir, ids=[item["id"] for item in items])
+    versions = history.get_create_versions(items)
+    new_items = [item for item, (new, _) in zip(items, versions) if new]
+    previous = history.latest_versions(item["id"] for item in new_items)
+
+    plan = []
+    for item, (new, rev) in zip(items, versions):
+        if not new:
+            continue
+        plan.append(
+            {
+                "id": item["id"],
+                "rev": rev,
+                "title": item.get("title"),
+                "artist": item.get("artist"),
+                "changes": field_changes(item, previous.get(item["id"])),
+            }
+        )
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List the cards that would be printed, without reading images or writing a PDF."
+    )
+    add_scan_arguments(parser)
+    parser.add_argument("--json", help="Also save the plan as JSON to this path.")
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Only print the changed fields, not their values.",
+    )
+    args = parser.parse_args()
+
+    scan = LibraryScan.from_args(args)
+    plan = plan_new_versions(scan, args.history)
+    scan.close()
+
+    for version in plan:
+        print(f"{version['id']} rev {version['rev']}: {version['artist']} - {version['title']}")
+        if version["rev"] == 1:
+            continue
+        for key, (old, new) in version["changes"].items():
+            if args.summary:
+                print(f"    {key}")
+            else:
+                print(f"    {key}: {old!r} -> {new!r}")
+
+    updated = sum(version["rev"] > 1 for version in plan)
+    print(f"{len(plan)} new versions: {len(plan) - updated} new tracks, {updated} updated")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(plan, f, indent=2, ensure_ascii=False)
+        print(f"Plan saved to {args.json}")
@@ -0,0 +1,172 @@
+import json
+import time
+import tracemalloc
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# Shared by every stage while profiling is disabled, so instrumented code only pays a call
+_DISABLED = nullcontext()
+
+
+class StageStats:
+    def __init__(self):
+        """Totals of one stage, excluding the time spent in nested stages."""
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+        self.bytes = 0
+        self.peak_memory = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "calls": self.calls,
+            "bytes": self.bytes,
+            "peak_traced_bytes": self.peak_memory,
+        }
+
+
+class Profiler:
+    def __init__(self, trace_memory: bool = False):
+        """
+        Records wall time, CPU time, calls and bytes processed per pipeline stage.
+
+        Stages may nest, e.g. QR drawing within PDF writing, and each stage is
+        only charged for its own time so the stages add up to the run time.
+
+        Args:
+            trace_memory (bool): Also record the peak traced memory of each stage with tracemalloc.
+        """
+        self.trace_memory = trace_memory
+        self.stages: dict[str, StageStats] = {}
+        # Per open stage: [name, wall start, cpu start, wall in children, cpu in children, peak]
+        self._stack: list[list[Any]] = []
+        self.started = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, size: int = 0) -> Iterator[None]:
+        frame = [name, time.perf_counter(), time.process_time(), 0.0, 0.0, 0]
+        if self.trace_memory:
+            frame[5] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - frame[1]
+            cpu = time.process_time() - frame[2]
+            self._stack.pop()
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.wall += wall - frame[3]
+            stats.cpu += cpu - frame[4]
+            stats.calls += 1
+            stats.bytes += size
+            if self.trace_memory:
+                peak = max(frame[5], tracemalloc.get_traced_memory()[1])
+                stats.peak_memory = max(stats.peak_memory, peak)
+                tracemalloc.reset_peak()
+            if self._stack:
+                parent = self._stack[-1]
+                parent[3] += wall
+                parent[4] += cpu
+                if self.trace_memory:
+                    parent[5] = max(parent[5], peak)
+
+    def add_bytes(self, name: str, size: int) -> None:
+        """Adds bytes processed by a stage outside of a `stage` block."""
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        stats.bytes += size
+
+    def report(self) -> dict[str, Any]:
+        """Returns the totals of every stage."""
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+        }
+
+    def summary(self) -> str:
+        """Formats the totals of every stage as a table, slowest first."""
+        total = time.perf_counter() - self.started
+        lines = [
+            f"{'stage':<16}{'wall s':>9}{'%':>6}{'cpu s':>9}{'calls':>9}{'MB':>9}"
+            + (f"{'peak MB':>9}" if self.trace_memory else "")
+        ]
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].wall):
+            line = (
+                f"{name:<16}{stats.wall:>9.3f}{100 * stats.wall / total:>6.1f}{stats.cpu:>9.3f}"
+                f"{stats.calls:>9}{stats.bytes / 1e6:>9.1f}"
+            )
+            if self.trace_memory:
+                line += f"{stats.peak_memory / 1e6:>9.1f}"
+            lines.append(line)
+        lines.append(f"{'total':<16}{total:>9.3f}")
+        return "\n".join(lines)
+
+    def save(self, report_path: str) -> None:
+        path = Path(report_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Profile saved to {path}")
+
+
+_profiler: Profiler | None = None
+
+
+def enable(trace_memory: bool = False) -> Profiler:
+    """Starts recording stages for the rest of the process."""
+    global _profiler
+    _profiler = Profiler(trace_memory=trace_memory)
+    return _profiler
+
+
+def stage(name: str, size: int = 0) -> AbstractContextManager:
+    """
+    Times a block as part of a stage, doing nothing unless profiling is enabled.
+
+    Args:
+        name (str): The stage name.
+        size (int): Number of bytes processed by the block.
+    """
+    if _profiler is None:
+        return _DISABLED
+    return _profiler.stage(name, size)
+
+
+def add_bytes(name: str, size: int) -> None:
+    """Adds bytes processed by a stage, doing nothing unless profiling is enabled."""
+    if _profiler is not None:
+        _profiler.add_bytes(name, size)
+
+
+def iterate(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """
+    Times each step of a lazy iterable as part of a stage.
+
+    Args:
+        name (str): The stage name.
+        iterable (Iterable): The iterable, returned unchanged unless profiling is enabled.
+    """
+    if _profiler is None:
+        return iter(iterable)
+    return _iterate(_profiler, name, iter(iterable))
+
+
+def _iterate(profiler: Profiler, name: str, iterator: Iterator[T]) -> Iterator[T]:
+    while True:
+        with profiler.stage(name):
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+        yield value
@@ -0,0 +1,242 @@
+import argparse
+import copy
+import hashlib
+import os
+from datetime import datetime
+from itertools import batched
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote
+
+from reportlab.pdfgen import canvas
+
+from .card_layout import CARD_HEIGHT, CARD_WIDTH, PAGE_HEIGHT, PAGE_WIDTH, PRINT_DPI, CardLayout
+from .cards import (
+    _card_offset,
+    back_art_size, back_art_x, back_art_y, back_qr_size, back_qr_x, back_qr_y,
+    create_pdf_with_layout,
+    draw_card_side,
+    field_layouts,
+    front_art_size, front_art_x, front_art_y, front_qr_size, front_qr_x, front_qr_y,
+)
+from .cover_art import CoverArt
+from .cover_art_store import DEFAULT_STORE_DIR, CoverArtStore
+from .field_layout import FieldLayout, compile_layouts
+from .metadata_cache import decode_metadata, encode_metadata
+
+DEFAULT_REPRINT_DIR = "data/reprint_cache"
+# Bump when card drawing changes in a way the layout hash does not capture.
+FRAGMENT_VERSION = 1
+
+
+def _undated(layouts: list[FieldLayout]) -> list[FieldLayout]:
+    """The layouts with the print date read from each card's 'datestamp' instead of today's prefix."""
+    undated = []
+    for field in layouts:
+        if field.field_name == "datestamp":
+            field = copy.copy(field)
+            field.prefix = ""
+        undated.append(field)
+    return undated
+
+
+def layout_hash(layouts: list[FieldLayout]) -> str:
+    """Hashes everything that decides how a card is drawn, apart from the card itself."""
+    geometry = (
+        front_art_x, front_art_y, front_art_size, front_qr_x, front_qr_y, front_qr_size,
+        back_art_x, back_art_y, back_art_size, back_qr_x, back_qr_y, back_qr_size,
+    )
+    key = repr((compile_layouts(layouts), geometry, CARD_WIDTH, CARD_HEIGHT, PRINT_DPI, FRAGMENT_VERSION))
+    return hashlib.md5(key.encode("utf-8")).hexdigest()[:12]
+
+
+class ReprintCache:
+    def __init__(self, cache_dir: str = DEFAULT_REPRINT_DIR, layouts: list[FieldLayout] = field_layouts):
+        """
+        Printed cards and their rendered sides, for reprinting without running the pipeline.
+
+        Every printed card is recorded by (track id, rev) with its print date.
+        Each side of a card is rendered once into a single card PDF fragment,
+        kept under the hash of the layout it was drawn with, and reprints
+        only place fragments onto sheets. Fragments are rendered on the first
+        reprint of a card rather than while printing it, as most cards are
+        never reprinted and drawing them twice would slow down every run.
+
+        Args:
+            cache_dir (str): Directory holding the card records and fragments.
+            layouts (list[FieldLayout]): Layout instructions for fields.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.layouts = _undated(layouts)
+        self.plan = compile_layouts(self.layouts)
+        self.layout_hash = layout_hash(self.layouts)
+
+    def _card_dir(self, track_id: str) -> Path:
+        return self.cache_dir / "cards" / quote(track_id, safe="")
+
+    def save_card(self, card: dict[str, Any], printed: str, cover_store: CoverArtStore) -> None:
+        """
+        Records a printed card.
+
+        The cover art is copied into the store and recorded by its MD5, as
+        its location in the audio file changes whenever the tags are rewritten.
+
+        Args:
+            card (dict): The card metadata, including its id and rev.
+            printed (str): The date printed on the card.
+            cover_store (CoverArtStore): Store the cover art is kept in for reprints.
+        """
+        record = dict(card, datestamp=printed)
+        cover_art = record.pop("cover_art", None)
+        if isinstance(cover_art, CoverArt):
+            try:
+                cover_store.original(cover_art)
+                record["cover_art_md5"] = cover_art.md5
+            except (OSError, ValueError) as e:
+                print(f"Error storing cover art of {card.get('file')} for reprints: {e}")
+        directory = self._card_dir(card["id"])
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{card['rev']}.json"
+        tmp_path = directory / f".{path.name}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(encode_metadata(record))
+        os.replace(tmp_path, path)
+
+    def load_card(
+        self, track_id: str, cover_store: CoverArtStore, rev: int | None = None
+    ) -> dict[str, Any] | None:
+        """
+        Loads a printed card.
+
+        Args:
+            track_id (str): The track id.
+            cover_store (CoverArtStore): Store holding the cover art recorded with the card.
+            rev (int | None): The revision, or None for the latest printed one.
+
+        Returns:
+            dict | None: The card, with its print date as 'datestamp', or None if it was never recorded.
+        """
+        directory = self._card_dir(track_id)
+        if rev is None:
+            revs = [int(path.stem) for path in directory.glob("*.json")] if directory.exists() else []
+            if not revs:
+                return None
+            rev = max(revs)
+        path = directory / f"{rev}.json"
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            card = decode_metadata(f.read())
+        md5 = card.pop("cover_art_md5", None)
+        if md5 is not None:
+            card["cover_art"] = cover_store.stored(md5)
+            if card["cover_art"] is None:
+                print(f"Cover art of {track_id} is no longer in {cover_store.store_dir}")
+        return card
+
+    def fragment(self, card: dict[str, Any], front: bool, cover_store: CoverArtStore | None = None) -> Path:
+        """
+        Returns a single card PDF of one side of a card, rendering it on first use.
+
+        Args:
+            card (dict): A card returned by `load_card`.
+            front (bool): Whether to render the front or the back.
+            cover_store (CoverArtStore | None): Store used to process each unique cover once.
+
+        Returns:
+            Path: The fragment PDF.
+        """
+        side = "front" if front else "back"
+        directory = self.cache_dir / "fragments" / self.layout_hash
+        path = directory / f"{quote(card['id'], safe='')}-{card['rev']}-{side}.pdf"
+        if path.exists():
+            return path
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / f".{path.name}.{os.getpid()}.tmp"
+        pdf = canvas.Canvas(str(tmp_path), pagesize=(CARD_WIDTH, CARD_HEIGHT))
+        layout = CardLayout(x_offset=0, y_offset=0, pdf=pdf, card=card, cover_store=cover_store)
+        draw_card_side(layout, self.plan, front=front)
+        pdf.showPage()
+        pdf.save()
+        os.replace(tmp_path, path)
+        return path
+
+
+def assemble_sheets(output_path: str, fragments: list[tuple[Path, Path]]) -> bool:
+    """
+    Places card fragments onto A4 sheets in the same order and duplex positions as `create_pdf_with_layout`.
+
+    Args:
+        output_path (str): Path to save the PDF.
+        fragments (list[tuple[Path, Path]]): The front and back fragment of each card.
+
+    Returns:
+        bool: False if pypdf is not installed.
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        return False
+    writer = PdfWriter()
+    readers: dict[Path, PdfReader] = {}
+    for sheet in batched(fragments, 4):
+        for front in (True, False):
+            page = writer.add_blank_page(PAGE_WIDTH, PAGE_HEIGHT)
+            for j, (front_path, back_path) in enumerate(sheet):
+                path = front_path if front else back_path
+                reader = readers.get(path)
+                if reader is None:
+                    reader = readers[path] = PdfReader(path)
+                x_offset, y_offset = _card_offset(j, front)
+                page.merge_translated_page(reader.pages[0], x_offset, y_offset)
+    # Cards from the same release share their cover images
+    writer.compress_identical_objects()
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprint cards of previously printed tracks.")
+    parser.add_argument("ids", nargs="*", help="Track ids to reprint, in print order.")
+    parser.add_argument("--ids-file", help="File with one track id per line.")
+    parser.add_argument("--output", help="Path of the PDF (default: reprint_<timestamp>.pdf).")
+    parser.add_argument("--reprint-cache", default=DEFAULT_REPRINT_DIR)
+    parser.add_argument("--cover-art", default=DEFAULT_STORE_DIR)
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="Draw the cards again instead of assembling cached fragments.",
+    )
+    args = parser.parse_args()
+
+    ids = list(args.ids)
+    if args.ids_file:
+        with open(args.ids_file, "r", encoding="utf-8") as f:
+            ids.extend(line.strip() for line in f if line.strip())
+
+    reprints = ReprintCache(args.reprint_cache)
+    cover_store = CoverArtStore(args.cover_art)
+    reprinted = []
+    for track_id in ids:
+        card = reprints.load_card(track_id, cover_store)
+        if card is None:
+            print(f"No printed card recorded for {track_id}")
+            continue
+        reprinted.append(card)
+    if not reprinted:
+        print("No cards to reprint")
+        return
+
+    output = args.output or f"reprint_{datetime.now().strftime('%Y-%m-%d@%H:%M')}.pdf"
+    if not args.render:
+        fragments = [
+            (reprints.fragment(card, True, cover_store), reprints.fragment(card, False, cover_store))
+            for card in reprinted
+        ]
+        if assemble_sheets(output, fragments):
+            print(f"Reprinted {len(reprinted)} cards to {output}")
+            return
+        print("pypdf is not installed, drawing the cards again")
+    create_pdf_with_layout(output, reprinted, reprints.layouts, cover_store=cover_store)
+    print(f"Reprinted {len(reprinted)} cards to {output}")
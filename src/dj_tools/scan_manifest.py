@@ -0,0 +1,94 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+MANIFEST_VERSION = 1
+
+
+class ScanManifest:
+    def __init__(self, manifest_path: str, full_rescan: bool = False):
+        """
+        Persistent record of the library files processed by previous runs.
+
+        Files whose size, mtime and inode still match their entry are treated
+        as unchanged and can be skipped before they are opened.
+
+        Args:
+            manifest_path (str): Path of the JSON manifest file.
+            full_rescan (bool): Treat every file as changed, ignoring existing entries.
+        """
+        self.manifest_path = Path(manifest_path)
+        self.full_rescan = full_rescan
+        self.entries: dict[str, dict[str, Any]] = self._load()
+        self.seen: dict[str, dict[str, Any]] = {}
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        """Load the manifest entries, returning nothing if the file is missing or outdated."""
+        if not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable scan manifest {self.manifest_path}: {e}")
+            return {}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("entries", {})
+
+    def is_unchanged(self, file_path: str, stat: os.stat_result) -> bool:
+        """
+        Checks whether a file matches its entry from the previous run.
+
+        Args:
+            file_path (str): The path to the file.
+            stat (os.stat_result): The current stat of the file.
+
+        Returns:
+            bool: True if the file can be skipped, False if it must be extracted.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None or self.full_rescan:
+            return False
+        if (
+            entry["size"] != stat.st_size
+            or entry["mtime_ns"] != stat.st_mtime_ns
+            or entry["inode"] != stat.st_ino
+        ):
+            return False
+        self.seen[file_path] = entry
+        return True
+
+    def record(
+        self, file_path: str, stat: os.stat_result, fingerprint: str | None
+    ) -> None:
+        """
+        Records a file as processed in this run.
+
+        Args:
+            file_path (str): The path to the file.
+            stat (os.stat_result): The stat of the file taken before extraction.
+            fingerprint (str | None): Fingerprint of the extracted metadata, if any.
+        """
+        self.seen[file_path] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino,
+            "fingerprint": fingerprint,
+        }
+
+    def save(self) -> None:
+        """Writes the manifest to disk, dropping entries for files that no longer exist."""
+        entries = {
+            path: entry
+            for path, entry in self.entries.items()
+            if path not in self.seen and os.path.exists(path)
+        }
+        entries.update(self.seen)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+        print(f"Scan manifest saved to {self.manifest_path}")
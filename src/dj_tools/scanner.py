@@ -1,11 +1,25 @@
+import argparse
+import time
+
 import cv2
 from pyzbar.pyzbar import decode
 import pyperclip
 import numpy as np
 
+from .track_index import DEFAULT_INDEX_PATH, TrackIndex, format_track
+
 
-def scan_qr_code():
-    cap = cv2.VideoCapture(0)
+def scan_qr_code(index: TrackIndex | None = None, camera: int = 0):
+    """
+    Scans QR codes of cards with a camera and copies them to the clipboard.
+
+    Args:
+        index (TrackIndex | None): Looks up scans by track id or exact search text, and the
+            track's full search text is copied. Other scans are copied as is, and the closest
+            tracks in the index are printed.
+        camera (int): Index of the camera to use.
+    """
+    cap = cv2.VideoCapture(camera)
     cap.set(cv2.CAP_PROP_FPS, 30)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
     cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
@@ -28,7 +42,23 @@ def scan_qr_code():
             # Only process and copy if it's different from the last QR code
             if qr_data != last_qr_data:
                 print(f"New QR Code Data: {qr_data}")
-                pyperclip.copy(qr_data)  # Copy to clipboard
+                clipboard = qr_data
+                if index is not None:
+                    start = time.perf_counter()
+                    track = index.exact(qr_data)
+                    candidates = index.search(qr_data) if track is None else []
+                    elapsed = time.perf_counter() - start
+                    if track is not None:
+                        print(f"Track: {format_track(track)} ({elapsed * 1000:.3f} ms)")
+                        clipboard = track["search"]
+                    elif candidates:
+                        # A guess could copy the wrong track, so the candidates are only listed
+                        print(f"No exact match in the index, candidates ({elapsed * 1000:.3f} ms):")
+                        for candidate, score in candidates:
+                            print(f"  {score:.2f} {format_track(candidate)}")
+                    else:
+                        print(f"No track found in the index ({elapsed * 1000:.3f} ms)")
+                pyperclip.copy(clipboard)  # Copy to clipboard
                 print("QR Code data copied to clipboard!")
                 last_qr_data = qr_data
 
@@ -54,5 +84,13 @@ def scan_qr_code():
     cv2.destroyAllWindows()
 
 
-# Run the scanner
-scan_qr_code()
+def main():
+    parser = argparse.ArgumentParser(description="Scan the QR codes of cards with a camera.")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="Path of the track index.")
+    parser.add_argument("--camera", type=int, default=0)
+    args = parser.parse_args()
+
+    index = TrackIndex.load(args.index)
+    if index is None:
+        print(f"No track index at {args.index}, copying scanned codes as is. Build it with track_index.")
+    scan_qr_code(index, camera=args.camera)
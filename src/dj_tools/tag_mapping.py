@@ -0,0 +1,249 @@
+from collections import Counter
+from typing import Any, Callable, Iterable
+
+from mutagen.flac import VCFLACDict
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4Tags
+from mutagen.oggvorbis import OggVCommentDict
+
+# Tags seen during extraction that no scheme extracts or skips, by tag key.
+# Collected instead of printed per file, see `report_unextracted`.
+unextracted_tags: Counter[str] = Counter()
+
+# Every field a scheme can extract, in the order they are added to the metadata
+METADATA_FIELDS = (
+    "id",
+    "title",
+    "artist",
+    "additional_artists",
+    "original_artist",
+    "remixer",
+    "album",
+    "original_album",
+    "genre",
+    "label",
+    "publisher",
+    "file_type",
+    "release_year",
+    "release_date",
+    "recording_date",
+    "starting_key",
+    "user_comment",
+    "user_comment_2",
+    "bpm",
+)
+
+
+def _first(value: Any) -> Any:
+    return value[0]
+
+
+class TagScheme:
+    def __init__(
+        self,
+        name: str,
+        fields: dict[str, tuple[str, ...]],
+        special: dict[str, tuple[str, Callable[[Any], Any]]] | None = None,
+        skip: Iterable[str] = (),
+        text: Callable[[Any], Any] = _first,
+        frame_id: Callable[[str], str] = lambda key: key,
+        normalize: Callable[[str], str] = lambda key: key,
+    ):
+        """
+        Declarative mapping from the tags of one mutagen tag format to metadata fields.
+
+        The mapping is compiled once into dict lookups, so `apply` reads every
+        tag exactly once, whatever the number of fields, fallbacks and
+        skipped tags.
+
+        Args:
+            name (str): Name of the tag format.
+            fields (dict): For each field, the tag keys to read it from in order of preference.
+                Like a chain of `or`, the first tag with a truthy value is used.
+            special (dict): For each frame id, the field it sets and how to read its value,
+                e.g. cover art or ratings. The last value that is not None wins.
+            skip (Iterable[str]): Frame ids or full tag keys that are deliberately not extracted.
+            text (Callable): Reads the value of a tag mapped in `fields`.
+            frame_id (Callable): Returns the frame id of a tag key, e.g. 'TXXX' for 'TXXX:BPM'.
+            normalize (Callable): Normalises tag keys, e.g. case-insensitive Vorbis comments.
+        """
+        self.name = name
+        self.text = text
+        self.frame_id = frame_id
+        self.normalize = normalize
+        self.special = {normalize(key): target for key, target in (special or {}).items()}
+        self.skip = frozenset(normalize(key) for key in skip)
+        self.lookup: dict[str, tuple[str, int]] = {}
+        for field, keys in fields.items():
+            for priority, key in enumerate(keys):
+                self.lookup[normalize(key)] = (field, priority)
+        self.chain_length = {field: len(keys) for field, keys in fields.items()}
+
+    def apply(self, tags: Any) -> tuple[dict[str, Any], list[tuple[str, Any]], list[str]]:
+        """
+        Maps tags to metadata fields in a single pass.
+
+        Args:
+            tags: A mutagen tags object (any mapping of tag keys to values).
+
+        Returns:
+            tuple: The value of every field in METADATA_FIELDS (None if missing), the
+            (field, value) pairs of special frames in tag order, and the keys of unknown tags.
+        """
+        found: dict[str, dict[int, Any]] = {}
+        special: list[tuple[str, Any]] = []
+        unknown: list[str] = []
+        for key, frame in tags.items():
+            key = self.normalize(key)
+            target = self.lookup.get(key)
+            if target is not None:
+                field, priority = target
+                found.setdefault(field, {})[priority] = self.text(frame)
+                continue
+            frame_id = self.frame_id(key)
+            handler = self.special.get(frame_id)
+            if handler is not None:
+                field, read = handler
+                special.append((field, read(frame)))
+            elif frame_id not in self.skip and key not in self.skip:
+                unknown.append(key)
+
+        values = dict.fromkeys(METADATA_FIELDS)
+        for field, candidates in found.items():
+            value = None
+            for priority in range(self.chain_length[field]):
+                value = candidates.get(priority)
+                if value:
+                    break
+            values[field] = value
+        return values, special, unknown
+
+
+def _ufid_owner(frame: Any) -> str | None:
+    return frame.owner.strip() or None
+
+
+ID3_SCHEME = TagScheme(
+    "ID3",
+    fields={
+        "id": ("TSRC", "TXXX:ISRC"),
+        "title": ("TIT2",),
+        "artist": ("TPE1", "TXXX:ALBUM ARTIST"),
+        "additional_artists": ("TPE2",),
+        "original_artist": ("TOPE",),
+        "remixer": ("TPE4", "TXXX:TraktorRemixer"),
+        "album": ("TALB",),
+        "original_album": ("TOAL",),
+        "genre": ("TCON",),
+        "label": ("TIT1", "TXXX:LABEL"),
+        "publisher": ("TPUB", "TXXX:ORGANIZATION"),
+        "file_type": ("TFLT", "TXXX:FILETYPE"),
+        "release_year": ("TDRL", "TXXX:YEAR"),
+        "release_date": ("TDOR", "TXXX:RELEASE_TIME"),
+        "recording_date": ("TDRC", "TXXX:RECORDING_DATE"),
+        "starting_key": ("TKEY", "TXXX:INITIAL_KEY"),
+        "user_comment": ("COMM::eng", "TXXX:COMMENT"),
+        "user_comment_2": ("COMM:ID3v1 Comment:eng",),
+        "bpm": ("TBPM", "TXXX:BPM"),
+    },
+    special={
+        "APIC": ("cover_art", lambda frame: frame.data),  # Attached (or linked) Picture
+        "POPM": ("rating", lambda frame: frame.rating),  # Popularimeter
+        "UFID": ("id", _ufid_owner),  # Unique file identifier
+    },
+    skip=(
+        "PRIV",  # Private frame
+        "TENC",  # Encoder
+        "TSSE",  # Encoder settings
+        "WOAF",  # Official File Information
+        "WPUB",  # Official Publisher Information
+        "TRCK",  # Track Number
+        "GEOB",  # General Encapsulated Object (serato overview)
+        "WCOM",  # Commercial Information
+        "RVA2",  # Relative volume adjustment (serato gain)
+        "TPOS",  # Part of set
+        "TCMP",  # iTunes Compilation Flag
+        "TCOM",  # Composer
+        "TXXX:SERATO_PLAYCOUNT",
+        "TXXX:TRACK_URL",
+        "TXXX:LABEL_URL",
+        "TXXX:FILEOWNER",
+    ),
+    text=lambda frame: frame.text[0],
+    frame_id=lambda key: key.split(":", 1)[0],
+)
+
+# FLAC and Ogg files; pictures are stored outside the comments and read separately
+VORBIS_SCHEME = TagScheme(
+    "Vorbis",
+    fields={
+        "id": ("isrc",),
+        "title": ("title",),
+        "artist": ("artist", "albumartist"),
+        "remixer": ("remixer", "mixartist"),
+        "album": ("album",),
+        "genre": ("genre",),
+        "label": ("label", "organization"),
+        "publisher": ("publisher",),
+        "release_date": ("originaldate", "releasedate"),
+        "recording_date": ("date",),
+        "starting_key": ("initialkey", "key"),
+        "user_comment": ("comment", "description"),
+        "bpm": ("bpm",),
+    },
+    skip=("encoder", "encodedby", "tracknumber", "tracktotal", "discnumber", "disctotal", "composer"),
+    normalize=str.lower,
+)
+
+
+def _mp4_text(value: Any) -> Any:
+    value = value[0]
+    if isinstance(value, bytes):  # Freeform '----' atoms
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, int):  # Integer atoms like 'tmpo'
+        return str(value)
+    return value
+
+
+MP4_SCHEME = TagScheme(
+    "MP4",
+    fields={
+        "id": ("----:com.apple.iTunes:ISRC",),
+        "title": ("\xa9nam",),
+        "artist": ("\xa9ART", "aART"),
+        "remixer": ("----:com.apple.iTunes:REMIXER",),
+        "album": ("\xa9alb",),
+        "genre": ("\xa9gen",),
+        "label": ("----:com.apple.iTunes:LABEL", "\xa9grp"),
+        "publisher": ("----:com.apple.iTunes:PUBLISHER",),
+        "release_date": ("----:com.apple.iTunes:originaldate",),
+        "recording_date": ("\xa9day",),
+        "starting_key": ("----:com.apple.iTunes:initialkey",),
+        "user_comment": ("\xa9cmt",),
+        "bpm": ("tmpo",),
+    },
+    special={"covr": ("cover_art", lambda value: bytes(value[0]))},
+    skip=("\xa9too", "trkn", "disk", "cpil", "\xa9wrt", "pgap", "----:com.apple.iTunes:iTunNORM"),
+    text=_mp4_text,
+)
+
+
+def scheme_for(tags: Any) -> TagScheme:
+    """Returns the scheme for a mutagen tags object (ID3 is also used by AIFF and WAV)."""
+    if isinstance(tags, ID3):
+        return ID3_SCHEME
+    if isinstance(tags, MP4Tags):
+        return MP4_SCHEME
+    if isinstance(tags, (VCFLACDict, OggVCommentDict)):
+        return VORBIS_SCHEME
+    raise ValueError(f"Unsupported tag format {type(tags).__name__}")
+
+
+def report_unextracted() -> None:
+    """Prints a summary of the tags that were neither extracted nor skipped, and resets it."""
+    if not unextracted_tags:
+        return
+    print("Unextracted tags:")
+    for key, count in unextracted_tags.most_common():
+        print(f"\t{key}: {count} files")
+    unextracted_tags.clear()
@@ -0,0 +1,281 @@
+import argparse
+import json
+import math
+import os
+import time
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from .metadata_extraction import search_text
+from .scan_manifest import ScanManifest
+
+DEFAULT_INDEX_PATH = "data/track_index.json"
+INDEX_VERSION = 1
+# QR codes only hold the start of the search text, see `image_manipulation._make_qr`
+QR_TEXT_LENGTH = 49
+# Minimum share of the query's token weight a fuzzy match must cover
+MIN_SCORE = 0.5
+# Minimum share of the query's words a fuzzy match must contain
+MIN_MATCHED = 0.5
+# Shorter words are only matched exactly, as one edit turns them into too many others
+MIN_FUZZY_LENGTH = 4
+
+# Fields of the latest version of each track kept in the index
+TRACK_FIELDS = ("id", "title", "artist", "starting_key", "bpm", "file")
+
+
+def _deletions(word: str) -> set[str]:
+    """The word and every word made by deleting one of its letters."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class TrackIndex:
+    def __init__(self, tracks: list[dict[str, Any]], postings: dict[str, list[int]] | None = None):
+        """
+        Index of the printed tracks, resolving scanned QR codes to a track.
+
+        Scans are looked up by track id, then by the exact (truncated) search
+        text printed in QR codes, and otherwise matched on the words of the
+        search text through an inverted index, allowing for words that were
+        truncated or changed since the card was printed. Words one edit apart
+        are found through a map of their one-letter deletions, built upfront
+        so that lookups while scanning stay fast.
+
+        Args:
+            tracks (list[dict]): Track id, path, title, artist, key, BPM and search text of each track.
+            postings (dict | None): For each word, the positions of the tracks whose search text contains
+                it, as saved with the index. Built from the tracks if not given.
+        """
+        self.tracks = tracks
+        if postings is None:
+            postings = {}
+            for position, track in enumerate(tracks):
+                for token in dict.fromkeys(track["search"].split()):
+                    postings.setdefault(token, []).append(position)
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.by_id = {track["id"].casefold(): track for track in tracks}
+        # Tracks whose search texts only differ after the truncation share a QR text, mapped to None
+        self.by_search: dict[str, dict[str, Any] | None] = {}
+        for track in tracks:
+            text = track["search"][:QR_TEXT_LENGTH]
+            self.by_search[text] = None if text in self.by_search else track
+        self.weights = {
+            token: math.log(1 + len(tracks) / len(positions)) for token, positions in postings.items()
+        }
+        self.track_tokens = [frozenset(track["search"].split()) for track in tracks]
+        # Words one edit apart share a word with at most one letter deleted
+        self.variants: dict[str, list[str]] = {}
+        for word in self.vocabulary:
+            if len(word) >= MIN_FUZZY_LENGTH - 1:
+                for variant in _deletions(word):
+                    self.variants.setdefault(variant, []).append(word)
+
+    @classmethod
+    def build(cls, history_dir: str, manifest_path: str) -> "TrackIndex":
+        """
+        Builds the index from the latest printed version of every track.
+
+        Args:
+            history_dir (str): Directory holding the Parquet snapshots.
+            manifest_path (str): The scan manifest, used to find the file of each version.
+
+        Returns:
+            TrackIndex: The index.
+        """
+        # Imported here so loading the index for scanning does not import pandas
+        from .version_history import VersionHistory
+
+        history = VersionHistory(history_dir)
+        if history.history is None:
+            return cls([])
+        ids = history.history["id"].dropna().unique()
+        latest = history.latest_versions(ids)
+
+        paths = {}
+        for path, entry in ScanManifest(manifest_path).entries.items():
+            if entry.get("fingerprint") is not None:
+                paths[entry["fingerprint"]] = path
+
+        tracks = []
+        for version in latest.values():
+            track = {field: version.get(field) for field in TRACK_FIELDS}
+            track["path"] = paths.get(version.get("fingerprint"))
+            track["search"] = search_text(version.get("title") or "", version.get("artist") or "")
+            tracks.append(track)
+        tracks.sort(key=lambda track: track["id"])
+        return cls(tracks)
+
+    @classmethod
+    def load(cls, index_path: str = DEFAULT_INDEX_PATH) -> "TrackIndex | None":
+        """Loads a saved index, returning None if it is missing or outdated."""
+        path = Path(index_path)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") != INDEX_VERSION:
+            return None
+        return cls(index["tracks"], index["postings"])
+
+    def save(self, index_path: str = DEFAULT_INDEX_PATH) -> None:
+        path = Path(index_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": INDEX_VERSION, "tracks": self.tracks, "postings": self.postings},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+        print(f"Track index of {len(self.tracks)} tracks saved to {path}")
+
+    def _candidates(self, token: str, last: bool) -> list[str]:
+        """Indexed words matching a query word that is not indexed."""
+        # The last word of a QR code may be cut off by the truncation
+        if last:
+            start = bisect_left(self.vocabulary, token)
+            prefixed = []
+            for word in self.vocabulary[start:]:
+                if not word.startswith(token):
+                    break
+                prefixed.append(word)
+            if prefixed:
+                return prefixed
+        if len(token) < MIN_FUZZY_LENGTH:
+            return []
+        matches = {word for variant in _deletions(token) for word in self.variants.get(variant, ())}
+        return sorted(matches)
+
+    def search(self, text: str, limit: int = 5) -> list[tuple[dict[str, Any], float]]:
+        """
+        Matches a text on the words of the tracks' search texts.
+
+        Words that match nothing weigh as much as the rarest indexed word, so
+        a single rare match among unknown words scores low, and only tracks
+        containing most of the words are returned.
+
+        Args:
+            text (str): The scanned text.
+            limit (int): Maximum number of matches.
+
+        Returns:
+            list[tuple[dict, float]]: The best matching tracks with the share of the text's word weight they match.
+        """
+        tokens = text.split()
+        unknown_weight = math.log(1 + len(self.tracks))
+        words = []
+        total = 0.0
+        for i, token in enumerate(tokens):
+            if token in self.postings:
+                matches = [token]
+                weight = self.weights[token]
+            else:
+                matches = self._candidates(token, last=i == len(tokens) - 1)
+                weight = max((self.weights[match] for match in matches), default=unknown_weight)
+            total += weight
+            if matches:
+                words.append((sum(len(self.postings[match]) for match in matches), matches, weight))
+        if not total:
+            return []
+
+        # Rare words find the candidates. Once there are fewer candidates than
+        # tracks with a word, common words ('original', 'remix') only add to them.
+        scores: Counter[int] = Counter()
+        matched: Counter[int] = Counter()
+        for size, matches, weight in sorted(words, key=lambda word: word[0]):
+            if scores and size > len(scores):
+                for position in scores:
+                    if any(match in self.track_tokens[position] for match in matches):
+                        scores[position] += weight
+                        matched[position] += 1
+                continue
+            for position in {position for match in matches for position in self.postings[match]}:
+                scores[position] += weight
+                matched[position] += 1
+        scores = Counter(
+            {position: score for position, score in scores.items() if matched[position] > MIN_MATCHED * len(tokens)}
+        )
+        return [(self.tracks[position], score / total) for position, score in scores.most_common(limit)]
+
+    def exact(self, text: str) -> dict[str, Any] | None:
+        """
+        Looks up a scanned QR code by track id or by the exact search text printed on the card.
+
+        Args:
+            text (str): The scanned text.
+
+        Returns:
+            dict | None: The track, or None if the text is neither or the printed search
+                text of several tracks.
+        """
+        track = self.by_id.get(text.casefold())
+        if track is not None:
+            return track
+        return self.by_search.get(text)
+
+    def resolve(self, text: str) -> dict[str, Any] | None:
+        """
+        Resolves a scanned QR code to a track.
+
+        Args:
+            text (str): The scanned text, a track id or the search text of a card.
+
+        Returns:
+            dict | None: The track, or None if nothing matches well enough, or
+                several tracks match equally well.
+        """
+        track = self.exact(text)
+        if track is not None:
+            return track
+        matches = self.search(text, limit=2)
+        if not matches or matches[0][1] < MIN_SCORE:
+            return None
+        if len(matches) > 1 and matches[1][1] >= matches[0][1]:
+            return None
+        return matches[0][0]
+
+
+def format_track(track: dict[str, Any]) -> str:
+    """Formats a resolved track for display."""
+    return (
+        f"{track['id']} {track.get('artist')} - {track.get('title')} "
+        f"[{track.get('starting_key')} {track.get('bpm')}] {track.get('path') or track.get('file')}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the track index used to resolve scanned QR codes.")
+    parser.add_argument("--history", default="data/track_history")
+    parser.add_argument("--manifest", default="data/scan_manifest.json")
+    parser.add_argument("--output", default=DEFAULT_INDEX_PATH)
+    parser.add_argument(
+        "--lookup",
+        action="append",
+        help="Resolve this scanned text with the saved index instead of building it (repeatable).",
+    )
+    args = parser.parse_args()
+
+    if not args.lookup:
+        TrackIndex.build(args.history, args.manifest).save(args.output)
+        return
+
+    index = TrackIndex.load(args.output)
+    if index is None:
+        print(f"No track index at {args.output}")
+        return
+    for text in args.lookup:
+        start = time.perf_counter()
+        track = index.resolve(text)
+        elapsed = time.perf_counter() - start
+        if track is None:
+            print(f"{text!r}: no match ({elapsed * 1000:.3f} ms)")
+        else:
+            print(f"{text!r}: {format_track(track)} ({elapsed * 1000:.3f} ms)")
+
+
+if __name__ == "__main__":
+    main()
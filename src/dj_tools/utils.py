@@ -1,5 +1,57 @@
 import os
-from typing import Any
+from fnmatch import fnmatch
+from typing import Any, Iterable, Iterator
+
+DEFAULT_EXCLUDE = ("*not printed*",)
+
+
+def _matches(name: str, patterns: Iterable[str]) -> bool:
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_library(
+    folder_path: str,
+    extensions: Iterable[str] = (".mp3",),
+    include: Iterable[str] | None = None,
+    exclude: Iterable[str] = DEFAULT_EXCLUDE,
+) -> Iterator[str]:
+    """
+    Lazily yields audio files in the specified folder and its subfolders.
+
+    Directories matching an exclude glob are pruned before they are read, and
+    files are yielded as soon as their directory entry is scanned.
+
+    Args:
+        folder_path (str): The path to the folder to scan.
+        extensions (Iterable[str]): File extensions to yield (case-insensitive).
+        include (Iterable[str] | None): If set, only file names matching one of these globs are yielded.
+        exclude (Iterable[str]): Globs for directory and file names to skip.
+
+    Yields:
+        str: Paths to matching files.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    include = tuple(include) if include is not None else None
+    exclude = tuple(exclude)
+
+    stack = [folder_path]
+    while stack:
+        directory = stack.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if _matches(entry.name, exclude):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(extensions):
+                        if include is None or _matches(entry.name, include):
+                            yield entry.path
+        except OSError as e:
+            print(f"Error scanning {directory}: {e}")
+            continue
+        stack.extend(reversed(subdirectories))
 
 
 def list_mp3_files(folder_path: str) -> list[str]:
@@ -12,11 +64,4 @@ def list_mp3_files(folder_path: str) -> list[str]:
     Returns:
         list[str]: A list of paths to MP3 files.
     """
-    mp3_files = []
-    for root, _, files in os.walk(folder_path):
-        if "not printed" in root:
-            continue
-        for file in files:
-            if file.lower().endswith(".mp3"):
-                mp3_files.append(os.path.join(root, file))
-    return mp3_files
+    return list(walk_library(folder_path))
@@ -1,11 +1,16 @@
+import argparse
 import json
-from typing import Any
+import os
+from typing import Any, Iterable
+import fastparquet
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
 
 import hashlib
 
+from .cover_art import CoverArt
+
 
 def md5(data: bytes | None) -> str:
     """
@@ -21,59 +26,200 @@ def md5(data: bytes | None) -> str:
     return md5_hash.hexdigest()  # Return the hash as a hexadecimal string
 
 
+COMPACTED_DIR = "compacted"
+COMPACTED_FILE = "history.parquet"
+COMPACTED_MANIFEST = "manifest.json"
+
+# Ids are sorted and min/max statistics written so readers can skip row groups by id.
+# Snapshots of a run are usually smaller than a row group, so only the first
+# snapshot of a library and the compacted base are split into prunable groups.
+ROW_GROUP_SIZE = 5_000
+PARQUET_WRITE_OPTIONS: dict[str, Any] = {
+    "engine": "fastparquet",
+    "stats": True,
+    "row_group_offsets": ROW_GROUP_SIZE,
+}
+
+
+# Metadata keys that are derived for display and never part of a version.
+DERIVED_KEYS = ("key_bpm", "rating", "search", "index")
+
+# Keys that are stored with a version but are not part of its content.
+NON_CONTENT_KEYS = DERIVED_KEYS + ("rev", "fingerprint")
+
+
+def item_fingerprint(item: dict[str, Any]) -> str:
+    """
+    Create the content fingerprint of a converted metadata item.
+
+    Two items get the same fingerprint exactly when they have the same set of
+    non-null fields and every field has the same string value.
+
+    :param item: Item as returned by `VersionHistory.convert_metadata`
+    :return: Hexadecimal MD5 hash of the item contents
+    """
+    key = "".join(
+        f"\x1e{k}\x1f{v}"
+        for k, v in sorted(item.items())
+        if k not in NON_CONTENT_KEYS and pd.notna(v)
+    )
+    return md5(key.encode("utf-8"))
+
+
+def _fingerprints(df: pd.DataFrame) -> pd.Series:
+    """Computes `item_fingerprint` for every row of a history DataFrame."""
+    key = pd.Series("", index=df.index, dtype=object)
+    for column in sorted(c for c in df.columns if c not in NON_CONTENT_KEYS):
+        values = df[column]
+        part = f"\x1e{column}\x1f" + values.astype(str)
+        key = key + part.where(values.notna(), "")
+    return key.map(lambda k: md5(k.encode("utf-8")))
+
+
 class VersionHistory:
-    def __init__(self, history_dir: str):
+    def __init__(
+        self,
+        history_dir: str,
+        columns: Iterable[str] | None = None,
+        ids: Iterable[str] | None = None,
+    ):
+        """
+        History of every printed version of every track.
+
+        Args:
+            history_dir (str): Directory holding the Parquet snapshots.
+            columns (Iterable[str] | None): Only load these columns (plus id, rev and fingerprint).
+            ids (Iterable[str] | None): Only load the history of these track ids. Row groups
+                whose id range excludes them are skipped, which pays off on the compacted
+                base and large snapshots. Small per-run snapshots are a single row group
+                that is read whenever the ids fall within its range.
+        """
         self.history_dir = Path(history_dir)
         self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.columns = (
+            None if columns is None else list(dict.fromkeys(["id", "rev", "fingerprint", *columns]))
+        )
+        self.ids = None if ids is None else sorted(set(ids))
         self.history: pd.DataFrame | None = self._load_existing_history()
         self.new_data: list[dict[str, Any]] = []
+        self._versions: tuple[pd.DataFrame, pd.Series] | None = None
+
+    def _load_compacted(self) -> tuple[Path | None, list[str]]:
+        """Returns the compacted base file, if any, and the names of the snapshots it covers."""
+        manifest_path = self.history_dir / COMPACTED_DIR / COMPACTED_MANIFEST
+        if not manifest_path.exists():
+            return None, []
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return self.history_dir / COMPACTED_DIR / COMPACTED_FILE, manifest["snapshots"]
 
     def _load_existing_history(self) -> pd.DataFrame | None:
-        """Load all existing Parquet files and combine them into a single DataFrame."""
-        files = list(self.history_dir.glob("*.parquet"))
-        if not files:
+        """Load the compacted base plus newer Parquet snapshots and combine them into a single DataFrame."""
+        files = sorted(self.history_dir.glob("*.parquet"))
+        base, covered = self._load_compacted()
+        if base is not None:
+            deltas = [file for file in files if file.name not in covered]
+            if any(file.name < covered[-1] for file in deltas):
+                # Revision numbering depends on snapshot order, so an older
+                # snapshot added after compaction can only be read in full.
+                if all((self.history_dir / name).exists() for name in covered):
+                    print(f"Ignoring {base}, snapshots were added before its newest snapshot")
+                    base = None
+                else:
+                    print(f"Warning: snapshots older than {base} were added, re-run compaction")
+            if base is not None:
+                files = [base] + deltas
+        if not files or self.ids == []:
             return None
-        files.sort()
         print("Loading files in this order:")
         for file in files:
             print(f"\t{file}")
-        return pd.concat([pd.read_parquet(file) for file in files], ignore_index=True)
+        return pd.concat([self._read_snapshot(file) for file in files], ignore_index=True)
 
-    def _get_current_versions(self, id: str) -> list[dict[str, Any]]:
-        if self.history is None:
-            return []
+    def _read_snapshot(self, file: Path) -> pd.DataFrame:
+        """Reads a snapshot, pushing the column and id selection down into the Parquet reader.
 
-        # Filter rows by the id
-        filtered_rows = self.history[self.history["id"] == id].reset_index()
-        # Convert rows to dictionaries and replace NaN with None
-        return [
-            {k: (None if pd.isna(v) else v) for k, v in row.items()}
-            for row in filtered_rows.to_dict(orient="records")
-        ]
+        Snapshots written before fingerprints existed are read in full and
+        get their fingerprints computed here.
+        """
+        available = fastparquet.ParquetFile(file).columns
+        options: dict[str, Any] = {}
+        if self.columns is not None and "fingerprint" in available:
+            options["columns"] = [c for c in self.columns if c in available]
+        if self.ids is not None:
+            options["filters"] = [("id", "in", self.ids)]
+        df = pd.read_parquet(file, **options)
+        if self.ids is not None:
+            # Filters only skip whole row groups, so drop the remaining rows here
+            df = df[df["id"].isin(self.ids)]
+        if "fingerprint" not in df.columns:
+            df = df.assign(fingerprint=_fingerprints(df))
+        elif df["fingerprint"].isna().any():
+            missing = df["fingerprint"].isna()
+            df = df.assign(fingerprint=df["fingerprint"].where(~missing, _fingerprints(df[missing])))
+        if self.columns is not None:
+            df = df[[c for c in self.columns if c in df.columns]]
+        return df
+
+    def _version_index(self) -> tuple[pd.DataFrame, pd.Series]:
+        """Returns the first revision of every distinct (id, version) in history, and the revision count per id."""
+        if self._versions is None:
+            history = self.history[self.history["id"].notna()]
+            versions = pd.DataFrame({"id": history["id"]})
+            # Rows without a stored rev are numbered by their position within the id
+            position = versions.groupby("id").cumcount() + 1
+            if "rev" in history.columns:
+                versions["rev"] = history["rev"].fillna(position).astype(int)
+            else:
+                versions["rev"] = position
+            versions["fingerprint"] = history["fingerprint"]
+            self._versions = (
+                versions.drop_duplicates(["id", "fingerprint"], keep="first"),
+                versions["id"].value_counts(),
+            )
+        return self._versions
 
-    def convert_metadata(self, metadata: dict[str, Any]) -> dict[str, Any]:
+    @staticmethod
+    def convert_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
         """Reformats metadata for history comparison."""
         item = {}
         for k, v in metadata.items():
-            if k in ["key_bpm", "rating", "search", "index"]:
+            if k in DERIVED_KEYS:
                 continue
             elif v is None:
                 continue
             elif k == "cover_art":
-                item["cover_art_md5"] = md5(v)
+                item["cover_art_md5"] = v.md5 if isinstance(v, CoverArt) else md5(v)
             else:
                 item[k] = v
         return item
 
-    def _str_equals(self, one: dict[str, Any], two: dict[str, Any]) -> bool:
-        if one.keys() != two.keys():
-            print("keys don't match")
-            return False
-        for key in one.keys():
-            if f"{one[key]}" != f"{two[key]}":
-                print("values don't match")
-                return False
-        return True
+    def get_create_versions(self, items: list[dict[str, Any]]) -> list[tuple[bool, int]]:
+        """Gets or creates versions for many items with a single join on (id, fingerprint).
+
+        Returns:
+           A list aligned with `items`, holding for each item
+           (True, #) if its a new version
+           (False, #) if its an existing version
+        """
+        if len(items) == 0:
+            return []
+        query = pd.DataFrame(
+            {
+                "id": [item["id"] for item in items],
+                "fingerprint": [item_fingerprint(item) for item in items],
+            }
+        )
+        if self.history is None:
+            return [(True, 1)] * len(items)
+
+        versions, counts = self._version_index()
+        merged = query.merge(versions, on=["id", "fingerprint"], how="left")
+        counts = query["id"].map(counts).fillna(0)
+        return [
+            (True, int(count) + 1) if pd.isna(rev) else (False, int(rev))
+            for rev, count in zip(merged["rev"], counts)
+        ]
 
     def get_create_version(self, item: dict[str, Any]) -> tuple[bool, int]:
         """Gets or creates a new version for the item.
@@ -82,16 +228,17 @@ class VersionHistory:
            (True, #) if its a new version
            (False, #) if its an existing version
         """
+        return self.get_create_versions([item])[0]
 
-        id = item["id"]
-        current_versions = self._get_current_versions(id=id)
-        for i, version in enumerate(current_versions):
-            ver = self.convert_metadata(version)
-            v = ver.pop("rev", i + 1)
-            if self._str_equals(ver, item):
-                return (False, v)
-        new_v = len(current_versions) + 1
-        return (True, new_v)
+    def latest_versions(self, ids: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """Returns the most recently printed version of each of the given track ids that has one."""
+        if self.history is None:
+            return {}
+        rows = self.history[self.history["id"].isin(list(ids))]
+        # Snapshots are loaded oldest first
+        rows = rows.drop_duplicates("id", keep="last").astype(object)
+        rows = rows.where(rows.notna(), None)
+        return {row["id"]: row for row in rows.to_dict("records")}
 
     def add_new_version(self, item: dict[str, Any]) -> None:
         self.new_data.append(item)
@@ -101,15 +248,78 @@ class VersionHistory:
         if len(self.new_data) == 0:
             return False
         df = pd.DataFrame(self.new_data)
+        df["fingerprint"] = [item_fingerprint(item) for item in self.new_data]
         df["release_date"] = df["release_date"].astype(str)
+        df = df.sort_values("id", kind="stable", ignore_index=True)
         file_path = Path.joinpath(self.history_dir, f"{timestamp}.parquet")
-        df.to_parquet(file_path)
+        df.to_parquet(file_path, index=False, **PARQUET_WRITE_OPTIONS)
         # file_path = Path.joinpath(self.history_dir, f"{timestamp}.jsonl")
         # df.to_json(file_path, orient="records", lines=True)
         print(f"New version saved to {file_path}")
         return True
 
 
+def compact_history(history_dir: str, prune: bool = False) -> Path | None:
+    """
+    Merges the compacted base and all newer snapshots into a new compacted base.
+
+    Rows are sorted by id, keeping each id's rows in snapshot order, so the
+    revision numbering of the loaded history is unchanged.
+
+    Args:
+        history_dir (str): The history directory.
+        prune (bool): Delete the snapshots covered by the new base.
+
+    Returns:
+        Path | None: The compacted file, or None if there is no history.
+    """
+    history = VersionHistory(history_dir)
+    if history.history is None:
+        print(f"No history to compact in {history_dir}")
+        return None
+
+    _, covered = history._load_compacted()
+    snapshots = sorted(set(covered) | {file.name for file in history.history_dir.glob("*.parquet")})
+    df = history.history.sort_values("id", kind="stable", ignore_index=True)
+
+    compacted_dir = history.history_dir / COMPACTED_DIR
+    compacted_dir.mkdir(exist_ok=True)
+    file_path = compacted_dir / COMPACTED_FILE
+    tmp_path = compacted_dir / f"{COMPACTED_FILE}.tmp"
+    df.to_parquet(
+        tmp_path,
+        index=False,
+        **PARQUET_WRITE_OPTIONS,
+    )
+    os.replace(tmp_path, file_path)
+
+    manifest_path = compacted_dir / COMPACTED_MANIFEST
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"snapshots": snapshots, "rows": len(df)}, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    print(f"Compacted {len(snapshots)} snapshots ({len(df)} rows) into {file_path}")
+
+    if prune:
+        for name in snapshots:
+            snapshot = history.history_dir / name
+            if snapshot.exists():
+                snapshot.unlink()
+                print(f"\tremoved {snapshot}")
+    return file_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact track history snapshots.")
+    parser.add_argument("--history", default="data/track_history")
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete the snapshots covered by the compacted file.",
+    )
+    args = parser.parse_args()
+    compact_history(args.history, prune=args.prune)
+
+
 {
     "duration": "6:28",
     "file": "Pastiche - It-s Wavy (Original Mix).mp3",